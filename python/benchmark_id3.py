@@ -0,0 +1,47 @@
+"""
+Benchmark of the lean ID3v2 text-frame reader (id3lib.id3v2) against full parsing by mutagen.
+
+Usage:
+benchmark_id3.py [track_count] [cover_kb]
+
+  track_count  Number of files in the synthetic corpus, defaults to 1000.
+  cover_kb     Size of front cover embedded in every file in kB, defaults to 100.
+"""
+
+import sys
+import tempfile
+import time
+
+from id3lib import id3v2, synthetic
+
+
+def measure(function, paths):
+    """Call the function for every path and return (elapsed_time, results)."""
+    time_start = time.perf_counter()
+    results = [function(path) for path in paths]
+    return (time.perf_counter() - time_start, results)
+
+
+def main():
+    track_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    cover_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        print(f'Creating corpus of {track_count} files with {cover_kb} kB covers...')
+        paths = synthetic.create_album(corpus_dir, track_count, cover_kb * 1024, cjk_ratio=0.5)
+
+        # the reader under test goes first, so it doesn't profit from warm page cache
+        (native_time, native_results) = measure(id3v2.read_text_frames, paths)
+        (mutagen_time, mutagen_results) = measure(id3v2.read_text_frames_mutagen, paths)
+
+    if native_results != mutagen_results:
+        print('ERROR: Results of the readers differ.')
+        sys.exit(1)
+
+    print(f'mutagen: {mutagen_time:8.3f} s  ({track_count / mutagen_time:10.0f} files/s)')
+    print(f'native:  {native_time:8.3f} s  ({track_count / native_time:10.0f} files/s)')
+    print(f'speedup: {mutagen_time / native_time:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
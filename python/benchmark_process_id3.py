@@ -0,0 +1,174 @@
+"""
+End-to-end benchmark of process_id3.py actions on synthetic MP3 libraries.
+
+For every library size, a synthetic album is generated and actions export, import, rename and
+playlist are run one after another, each in a fresh Python process. Wall time, peak RSS of the
+process and number of files rewritten (modified or renamed) are recorded and compared with
+a stored baseline.
+
+Usage:
+benchmark_process_id3.py [-c cover_kb] [-j cjk_ratio] [-o options] [-b baseline] [-s] [sizes]
+
+  -c     Size of the front cover in kB, it is embedded in every track and used for import.
+         Defaults to 10.
+  -j     Ratio of Chinese/Japanese titles, defaults to 0.5.
+  -o     Comma separated options of process_id3.py for export, eg. 'pinyin'.
+  -b     Path to the baseline JSON file, defaults to benchmark_process_id3.json.
+  -s     Save the results as the new baseline.
+  sizes  Comma separated numbers of tracks, defaults to 10,1000,100000.
+
+Peak RSS is measured only on platforms with module 'resource' (not on Windows).
+"""
+
+import contextlib
+import getopt
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from id3lib import synthetic
+
+ACTIONS = [
+    ('export', 'export_to_xml'),
+    ('import', 'import_from_xml'),
+    ('rename', 'rename_files'),
+    ('playlist', 'create_playlist'),
+]
+
+DEFAULT_SIZES = [10, 1000, 100000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'benchmark_process_id3.json')
+
+
+def run_action(album_dir, action, options):
+    """Run a single action in the current process and print its measurements as JSON.
+    This is the entry point of the child processes.
+    """
+    import process_id3
+
+    method = dict(ACTIONS)[action]
+    opts = process_id3.Options.NONE
+    for opt in filter(None, options.split(',')):
+        opts |= process_id3.Options[opt.upper()]
+
+    os.chdir(album_dir)
+    time_start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        album_info = process_id3.AlbumInfo('.', opts)
+        getattr(album_info, method)()
+    wall_time = time.perf_counter() - time_start
+
+    peak_rss = None
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak_rss *= 1024  # kB on Linux, bytes on macOS
+    print(json.dumps({'wall_time': wall_time, 'peak_rss': peak_rss}))
+
+
+def snapshot(album_dir):
+    """Return dict filename -> mtime of all files in the folder."""
+    with os.scandir(album_dir) as entries:
+        return {x.name: x.stat().st_mtime_ns for x in entries if x.is_file()}
+
+
+def measure(album_dir, action, options):
+    """Run the action in a child process and return its measurements."""
+    before = snapshot(album_dir)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run', album_dir, action, options],
+        check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    after = snapshot(album_dir)
+
+    result = json.loads(output.splitlines()[-1])
+    result['files_rewritten'] = sum(1 for k, v in after.items()
+                                    if k.endswith('.mp3') and before.get(k) != v)
+    return result
+
+
+def format_change(value, baseline):
+    """Format relative change of value against baseline."""
+    if baseline is None or value is None or not baseline:
+        return ''
+    return f'{100 * (value - baseline) / baseline:+7.1f}%'
+
+
+def main():
+    cover_kb = 10
+    cjk_ratio = 0.5
+    options = ''
+    baseline_path = DEFAULT_BASELINE
+    save_baseline = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hc:j:o:b:s')
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(__doc__)
+            sys.exit()
+        elif opt == '-c':
+            cover_kb = int(arg)
+        elif opt == '-j':
+            cjk_ratio = float(arg)
+        elif opt == '-o':
+            options = arg
+        elif opt == '-b':
+            baseline_path = arg
+        elif opt == '-s':
+            save_baseline = True
+
+    sizes = [int(x) for x in args[0].split(',')] if len(args) > 0 else DEFAULT_SIZES
+
+    baseline = {}
+    if os.path.isfile(baseline_path):
+        with open(baseline_path, 'rt', encoding='utf-8') as fobj:
+            baseline = json.load(fobj)
+
+    results = {}
+    print(f'{"tracks":>8} {"action":<10} {"time [s]":>10} {"":>8} {"RSS [MB]":>10} {"":>8}'
+          f' {"rewritten":>10}')
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as album_dir:
+            synthetic.create_album(album_dir, size, cover_kb * 1024, cjk_ratio)
+            if cover_kb > 0:
+                with open(os.path.join(album_dir, 'cover.jpg'), 'wb') as fobj:
+                    fobj.write(b'\xff\xd8' + os.urandom(cover_kb * 1024 - 2))
+
+            for action, _ in ACTIONS:
+                key = f'{size}/{action}'
+                result = measure(album_dir, action, options)
+                results[key] = result
+                base = baseline.get(key, {})
+                rss = result['peak_rss'] / 2**20 if result['peak_rss'] is not None else 0
+                print(f'{size:>8} {action:<10} {result["wall_time"]:>10.3f}'
+                      f' {format_change(result["wall_time"], base.get("wall_time")):>8}'
+                      f' {rss:>10.1f}'
+                      f' {format_change(result["peak_rss"], base.get("peak_rss")):>8}'
+                      f' {result["files_rewritten"]:>10}')
+
+    if save_baseline:
+        baseline.update(results)
+        with open(baseline_path, 'wt', encoding='utf-8') as fobj:
+            json.dump(baseline, fobj, indent=2)
+        print(f'Baseline saved to \'{baseline_path}\'.')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5 and sys.argv[1] == '--run':
+        run_action(*sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,241 @@
+"""
+Converts tables generated by bin2c.py (or any C array of integers) back to binary data.
+
+Usage:
+c2bin.py -i <input_file> [-o <output_file>] [-w <word_len>] [--verify <original_file>]
+
+  -i        Text file with the table, values in hex (0x1234) or decimal, signed or unsigned,
+            separated by commas and/or whitespace. A C declaration around the values
+            (eg. 'const uint16_t data[] = { ... };') and C comments are skipped.
+  -o        Output binary file.
+  -w        Length of a word in bytes (1, 2, 4 or 8), little endian. Defaults to 2.
+  --verify  Compare the regenerated binary data with the original file instead of (or besides)
+            writing them. Both files are streamed, the original through mmap.
+
+The table is parsed in chunks, every chunk is tokenized and converted to integers by NumPy at
+once, so even tables of hundreds of MB are converted in seconds.
+"""
+
+import sys
+import getopt
+import mmap
+import os
+import re
+
+import numpy as np
+
+# size of text chunks parsed at once
+CHUNK_SIZE = 1 << 23
+
+# value of every character as a digit, -1 for non-digits
+DIGITS = np.full(256, -1, dtype=np.int8)
+DIGITS[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+DIGITS[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+DIGITS[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+
+# characters allowed between the values
+SEPARATORS = np.zeros(256, dtype=bool)
+SEPARATORS[np.frombuffer(b' \t\r\n,-+', dtype=np.uint8)] = True
+
+# C comments, a block comment can be unterminated at the end of the text
+COMMENTS_REGEX = re.compile(rb'/\*.*?(?:\*/|\Z)|//[^\n]*', re.DOTALL)
+
+# longest tokens which are converted exactly by uint64 arithmetic, per base
+SAFE_DIGITS = {10: 19, 16: 16}
+
+def table_body(data):
+	# values are between braces of the C declaration, if there is one
+	start = data.find(b'{')
+	if start < 0:
+		return (0, len(data))
+	end = data.rfind(b'}')
+	if end < start:
+		end = len(data)
+	return (start + 1, end)
+
+def blank_comments(text):
+	return COMMENTS_REGEX.sub(lambda m: b' ' * len(m.group()), text)
+
+def iter_chunks(data, start, end):
+	"""Yield the text in chunks with comments blanked out. Chunks end at a line end or a comma
+	outside comments, so no value or comment is cut. If there is none, the chunk is extended."""
+	size = CHUNK_SIZE
+	while start < end:
+		stop = min(start + size, end)
+		text = blank_comments(data[start:stop])
+		if stop < end:
+			cut = text.rfind(b'\n')
+			if cut < 0:
+				cut = text.rfind(b',')
+			if cut < 0:
+				size *= 2
+				continue
+			text = text[:cut + 1]
+			stop = start + cut + 1
+		yield text
+		start = stop
+		size = CHUNK_SIZE
+
+def detect_base(data, start, end):
+	# the whole table is in one base, hex if any value has prefix 0x
+	for text in iter_chunks(data, start, end):
+		if b'0x' in text or b'0X' in text:
+			return 16
+	return 10
+
+def parse_values(text, base, wordlen):
+	"""Parse all integer values in the text (with comments blanked out) at once, without a loop
+	over the tokens. Values must fit in the word, signed or unsigned.
+
+	Returns:
+	NumPy array of uint64 values, negative ones in two's complement.
+	"""
+	if base == 16:
+		text = text.replace(b'0x', b'').replace(b'0X', b'')
+	buf = np.frombuffer(text, dtype=np.uint8)
+
+	# validate characters
+	digits = DIGITS[buf]
+	is_digit = (digits >= 0) & (digits < base)
+	invalid = np.flatnonzero(~is_digit & ~SEPARATORS[buf])
+	if len(invalid) > 0:
+		pos = invalid[0]
+		raise ValueError('invalid character %r near %r' % (chr(buf[pos]), text[max(pos - 20, 0):pos + 20]))
+
+	# tokens are runs of digits
+	idx = np.flatnonzero(is_digit)
+	if len(idx) == 0:
+		return np.zeros(0, dtype=np.uint64)
+	starts = np.flatnonzero(np.diff(idx, prepend=-2) != 1)
+	lengths = np.diff(np.append(starts, len(idx)))
+
+	# value = sum of digits weighted by powers of the base, per token
+	token = np.repeat(np.arange(len(starts)), lengths)
+	from_end = (starts + lengths - 1)[token] - np.arange(len(idx))
+	weights = np.power(np.uint64(base), from_end.astype(np.uint64))
+	values = np.add.reduceat(digits[idx].astype(np.uint64) * weights, starts)
+
+	# the few longer tokens (eg. large decimal uint64) would overflow, they are converted exactly
+	for i in np.flatnonzero(lengths > SAFE_DIGITS[base]):
+		pos = idx[starts[i]]
+		value = int(text[pos:pos + lengths[i]], base)
+		if value >= 1 << 64:
+			raise ValueError('value out of range of %d-byte word' % wordlen)
+		values[i] = value
+
+	# minus sign right before the token
+	first = idx[starts]
+	negative = np.zeros(len(starts), dtype=bool)
+	negative[first > 0] = buf[first[first > 0] - 1] == ord('-')
+
+	# both signed and unsigned values must fit in the word, they are stored in two's complement
+	bits = 8 * wordlen
+	if (values[~negative] > np.uint64((1 << bits) - 1)).any() or \
+	   (values[negative] > np.uint64(1 << (bits - 1))).any():
+		raise ValueError('value out of range of %d-byte word' % wordlen)
+	values[negative] = np.negative(values[negative])
+	return values
+
+def to_bytes(values, wordlen):
+	return values.astype('<u%d' % wordlen).tobytes()
+
+def c2bin(in_filename, out_filename, wordlen, verify_filename=None):
+	"""Convert the table to binary data, write them and/or compare them with the original.
+
+	Returns:
+	True if the data match the original (or nothing is verified), False otherwise.
+	"""
+	outfile = open(out_filename, 'wb') if out_filename else None
+	verify_file = open(verify_filename, 'rb') if verify_filename else None
+	original = None
+	if verify_file is not None and os.path.getsize(verify_filename) > 0:
+		original = mmap.mmap(verify_file.fileno(), 0, access=mmap.ACCESS_READ)
+	original_size = len(original) if original is not None else 0
+
+	offset = 0
+	mismatch = None
+	with open(in_filename, 'rb') as infile:
+		if os.path.getsize(in_filename) > 0:
+			data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			data = b''
+		(start, end) = table_body(data)
+		base = detect_base(data, start, end)
+		for chunk in iter_chunks(data, start, end):
+			words = to_bytes(parse_values(chunk, base, wordlen), wordlen)
+			if outfile is not None:
+				outfile.write(words)
+			if verify_file is not None and mismatch is None:
+				expected = original[offset:offset + len(words)] if original is not None else b''
+				if expected != words:
+					diff = np.frombuffer(expected, dtype=np.uint8) != \
+					       np.frombuffer(words[:len(expected)], dtype=np.uint8)
+					mismatch = offset + (int(np.argmax(diff)) if diff.any() else len(expected))
+			offset += len(words)
+		if isinstance(data, mmap.mmap):
+			data.close()
+
+	if outfile is not None:
+		outfile.close()
+	if verify_file is None:
+		return True
+
+	if original is not None:
+		original.close()
+	verify_file.close()
+	if mismatch is None and offset != original_size:
+		mismatch = min(offset, original_size)
+	if mismatch is not None:
+		print('ERROR: data differ from %s at byte offset %d (word %d), lengths %d and %d bytes' %
+		      (verify_filename, mismatch, mismatch // wordlen, offset, original_size))
+		return False
+	print('OK: %d bytes match %s' % (offset, verify_filename))
+	return True
+
+def usage():
+	print("c2bin -i <input_file> -o <output_file> -w <word_len> --verify <original_file>")
+
+def main(argv):
+	infn = 'data.txt'
+	outfn = None
+	wordlen = 2
+	verifyfn = None
+
+	try:
+		opts, args = getopt.getopt(argv, "hi:o:w:v:", ["verify="])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		if opt == '-h':
+			usage()
+			sys.exit()
+		elif opt == '-i':
+			infn = arg
+		elif opt == '-o':
+			outfn = arg
+		elif opt == '-w':
+			wordlen = int(arg)
+			if (wordlen not in (1, 2, 4, 8)):
+				print('error: only wordlen = 1, 2, 4 or 8 supported')
+				sys.exit(2)
+		elif opt in ('-v', '--verify'):
+			verifyfn = arg
+
+	if (outfn is None) and (verifyfn is None):
+		usage()
+		sys.exit(2)
+
+	try:
+		matches = c2bin(infn, outfn, wordlen, verifyfn)
+	except ValueError as e:
+		print('error: %s: %s' % (infn, e))
+		sys.exit(2)
+	if not matches:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
+
+# vim: set ft=python ts=4 sts=4 sw=4 ai noexpandtab :
@@ -0,0 +1,102 @@
+"""
+cover_store.py: extracts cover art of the MP3 library to a content-addressed store and embeds
+it back from there.
+
+Usage:
+cover_store.py [-s store_dir] [-j workers] extract [root_dir]
+cover_store.py [-s store_dir] stats [root_dir]
+cover_store.py [-s store_dir] replace hash image.jpg [root_dir]
+cover_store.py [-s store_dir] [-j workers] [-n] embed [root_dir]
+
+  extract   Store every distinct cover once and index which track has which cover.
+  stats     List the stored covers with number of tracks using them.
+  replace   Store the image and point all tracks with the cover 'hash' to it. Run 'embed'
+            afterwards to write it to the tracks.
+  embed     Embed covers to the tracks per the index, only tracks with a different cover are
+            written.
+  root_dir  Root of the directory tree with MP3 files, defaults to current folder.
+  -s        Store folder, defaults to '.covers' in the root folder.
+  -j        Number of worker threads.
+  -n        Dry run, only print the tracks which would be written.
+"""
+
+import getopt
+import os
+import sys
+
+from id3lib import covers
+
+
+def main():
+    store_dir = None
+    max_workers = None
+    dry_run = False
+
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], 'hs:j:n')
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(__doc__)
+            sys.exit()
+        elif opt == '-s':
+            store_dir = arg
+        elif opt == '-j':
+            max_workers = int(arg)
+        elif opt == '-n':
+            dry_run = True
+
+    command = args.pop(0) if len(args) > 0 else None
+    params = 2 if command == 'replace' else 0
+    if command not in ('extract', 'stats', 'replace', 'embed') or \
+            not params <= len(args) <= params + 1:
+        print(__doc__)
+        sys.exit(2)
+    root_dir = args[params] if len(args) > params else '.'
+    if store_dir is None:
+        store_dir = os.path.join(root_dir, '.covers')
+    store = covers.CoverStore(store_dir)
+
+    if command == 'extract':
+        (with_cover, without_cover) = covers.extract_covers(root_dir, store, max_workers)
+        store.save()
+        print(f'{with_cover} track(s) with cover, {without_cover} without cover.')
+
+    if command == 'stats':
+        usage = {}
+        for digest in store.tracks.values():
+            usage[digest] = usage.get(digest, 0) + 1
+        embedded = 0
+        for digest, count in sorted(usage.items(), key=lambda x: -x[1]):
+            size = store.covers[digest]['size']
+            embedded += size * count
+            print(f'{digest[:16]} {count:>6} track(s) {size:>10} B  {store.cover_path(digest)}')
+        stored = sum(store.covers[x]['size'] for x in usage)
+        print(f'{len(usage)} cover(s), {stored} B stored, {embedded} B embedded in tracks.')
+
+    if command == 'replace':
+        (old_digest, image_path) = args[:2]
+        matches = [x for x in store.covers if x.startswith(old_digest)]
+        if len(matches) != 1:
+            print(f'ERROR: Hash \'{old_digest}\' matches {len(matches)} cover(s).')
+            sys.exit(1)
+        with open(image_path, 'rb') as fobj:
+            image = fobj.read()
+        mime = 'image/png' if image_path.lower().endswith('.png') else 'image/jpeg'
+        count = covers.replace_cover(store, matches[0], image, mime)
+        store.save()
+        print(f'{count} track(s) pointed to \'{image_path}\'.')
+
+    if command == 'embed':
+        written = covers.embed_covers(root_dir, store, max_workers, dry_run)
+        for path in written:
+            print(path)
+        verb = 'would be written' if dry_run else 'written'
+        print(f'{len(written)} track(s) {verb}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,13 @@
 """Creates dual monitor wallpaper by combining two single images.
 
+Usage:
+create_dual_wallpaper.py [folders] [fit]
+
+  folders  Process every subdirectory of the current directory, in parallel. Names of the created
+           files start with the name of the subdirectory.
+  fit      If no image of the exact size is found, resize and crop the closest-fitting image
+           to the resolution of the display.
+
 This script requires PIL module. Nowadays it is distributed as part of Pillow package. You install
 it just by entering:
   python -m pip install Pillow
@@ -10,7 +18,8 @@ you use Python 3.6, it is recommended to install Pillow 4.0.0 instead, it works
 
 import os
 import sys
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
 
 # size of first image (= resolution of left display)
 IMG1_WIDTH = 1366
@@ -19,27 +28,76 @@ IMG1_HEIGHT = 768
 IMG2_WIDTH = 1280
 IMG2_HEIGHT = 1024
 
-def combine(input_dir='.', output_dir='.'):
+# resampling filter used when fitting images to the display resolution
+FIT_RESAMPLE = Image.BILINEAR
+
+def fit_score(img_size, display_size):
+    """Returns how badly an image fits to a display, lower is better.
+
+    The score is dominated by difference of aspect ratios (which determines how much gets cropped),
+    images smaller than the display are penalized because they would have to be upscaled.
+    """
+    img_ratio = img_size[0] / img_size[1]
+    display_ratio = display_size[0] / display_size[1]
+    score = abs(img_ratio - display_ratio) / display_ratio
+    scale = max(display_size[0] / img_size[0], display_size[1] / img_size[1])
+    if scale > 1:
+        score += scale - 1
+    return score
+
+def fit_image(path, size):
+    """Loads the image and resizes and crops it to the given size. The image is opened again for
+    every call, as draft() below changes the image object, so it can't be reused for another size.
+    """
+    img = Image.open(path)
+    # let JPEG decoder downscale the image already while decoding, it is much faster
+    img.draft('RGB', size)
+    return ImageOps.fit(img.convert('RGB'), size, method=FIT_RESAMPLE)
+
+def combine(input_dir='.', output_dir='.', fit=False, prefix=''):
     """Combines two images of required sizes and saves it as new image.
+    If 'fit' is True and there are no images of required sizes, the closest-fitting images are
+    resized and cropped to the required sizes. Name of the new image starts with 'prefix'.
     Returns tuplet (resultcode, output_filename).
     """
     img1 = None
     img2 = None
+    size1 = (IMG1_WIDTH, IMG1_HEIGHT)
+    size2 = (IMG2_WIDTH, IMG2_HEIGHT)
+    candidates = []
 
     # browse through files and look for images with required size
-    files_list = os.listdir(input_dir)
+    files_list = sorted(os.listdir(input_dir))
     for filename in files_list:
         ext = os.path.splitext(filename)
         if len(ext) > 0 and (ext[1] == '.jpg' or ext[1] == '.jpeg'):
             img = Image.open(os.path.join(input_dir, filename))
+            exact = False
             if img.size[0] == IMG1_WIDTH and img.size[1] == IMG1_HEIGHT:
                 img1 = img
                 img1_filename = filename
+                exact = True
             if img.size[0] == IMG2_WIDTH and img.size[1] == IMG2_HEIGHT:
                 img2 = img
                 img2_filename = filename
+                exact = True
             if img1 is not None and img2 is not None:
                 break
+            # exact matches are used as they are, they aren't fitted to the other display
+            if not exact:
+                candidates.append((filename, img))
+
+    # pick the closest-fitting images for the displays which have no exact match
+    if fit and len(candidates) > 0:
+        if img1 is None:
+            img1_filename = min(candidates, key=lambda x: fit_score(x[1].size, size1))[0]
+            img1 = fit_image(os.path.join(input_dir, img1_filename), size1)
+            if len(candidates) > 1:
+                candidates = [x for x in candidates if x[0] != img1_filename]
+        if img2 is None:
+            img2_filename = min(candidates, key=lambda x: fit_score(x[1].size, size2))[0]
+            img2 = fit_image(os.path.join(input_dir, img2_filename), size2)
+
     if img1 is None or img2 is None:
         return (False, None)
 
@@ -49,26 +107,36 @@ def combine(input_dir='.', output_dir='.'):
     output_img.paste(img2, (IMG1_WIDTH, 0, IMG1_WIDTH + IMG2_WIDTH, IMG2_HEIGHT))
 
     # save new image to a file
-    output_img_filename = str.format('{0}_{1}.jpg', os.path.splitext(img1_filename)[0],
+    output_img_filename = str.format('{0}{1}_{2}.jpg', prefix, os.path.splitext(img1_filename)[0],
                                      os.path.splitext(img2_filename)[0])
     output_img_filepath = os.path.join(output_dir, output_img_filename)
     output_img.save(output_img_filepath, 'jpeg', quality=95)
 
     return (True, output_img_filename)
 
+def combine_folder(item, fit):
+    """Combines images in a subdirectory and saves the result to the current directory, its name
+    is prefixed by the name of the subdirectory, so the parallel workers never overwrite files of
+    each other.
+    Returns tuplet (item, resultcode, output_filename).
+    """
+    (result, filename) = combine(item, fit=fit, prefix=f'{item}_')
+    return (item, result, filename)
+
 def main():
     """Do the script's main job."""
-    if len(sys.argv) > 1 and sys.argv[1] == 'folders':
-        list_filenames = os.listdir()
-        for item in list_filenames:
-            if not os.path.isfile(item):
-                (result, filename) = combine(item)
+    fit = 'fit' in sys.argv[1:]
+    if 'folders' in sys.argv[1:]:
+        folders = [x for x in sorted(os.listdir()) if os.path.isdir(x)]
+        with ProcessPoolExecutor() as executor:
+            results = executor.map(combine_folder, folders, [fit] * len(folders))
+            for (item, result, filename) in results:
                 if result:
                     print(str.format('{0}: created file \'{1}\'', item, filename))
                 else:
                     print(str.format('{0}: nothing created', item))
     else:
-        (result, filename) = combine()
+        (result, filename) = combine(fit=fit)
         if result:
             print(str.format('Created file \'{0}\'', filename))
         else:
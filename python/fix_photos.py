@@ -3,44 +3,408 @@ Script for fixing of photos from Jiri's travels.
 Performs two operations:
 1. Renames the photo files to format originally assigned by the Samsung smartphone,
    based on datetime in their EXIF.
-2. TODO Renames the directories per the same pattern.
+2. Renames the directories per their date range, eg. '2016-10 Vietnam' to
+   '20161010-20161024 Vietnam'. Only directories whose name starts with a year are renamed.
+
+EXIF datetime, camera and GPS position of every photo are kept in an SQLite index, keyed by
+path, modification time and size. Only new or changed photos are read on every run, so the
+index can also answer queries on the whole archive instantly.
+
+Usage:
+fix_photos.py [-r root_dir] [-d database] [-n] [-j workers] [command]
+
+  command    One of:
+               fix          Rename photos, then directories (default).
+               photos       Rename photos only.
+               dirs         Rename directories only.
+               index        Only update the index.
+               query from [to]
+                            List photos taken between dates (inclusive), eg. 2016-10-10.
+               check        List photos outside the date range of their directory name.
+  -r         Root of the photo archive, defaults to current folder.
+  -d         Path to the index database, defaults to photos.sqlite in the root folder.
+  -n         Dry run, only print what would be renamed.
+  -j         Number of worker threads reading EXIF of new photos.
+
+Reports are printed as 'path;result[;new_path]' lines.
 """
 
+import getopt
 import os
+import re
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
 from PIL import Image
 
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg')
+DEFAULT_DATABASE = 'photos.sqlite'
+
+# EXIF tags
+EXIF_DATETIME = 306
+EXIF_MAKE = 271
+EXIF_MODEL = 272
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+GPS_IFD = 0x8825
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+EXIF_DATETIME_REGEX = re.compile(r'^(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})')
+
+# date prefix of directory names: year, optionally month and day, optionally a range
+DIR_DATE_REGEX = re.compile(
+    r'^(20\d{2})(?:[-_.]?(\d{2}))?(?:[-_.]?(\d{2}))?'
+    r'(?:\s*-\s*(20\d{2})(?:[-_.]?(\d{2}))?(?:[-_.]?(\d{2}))?)?(?=\D|$)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    taken TEXT,
+    camera TEXT,
+    latitude REAL,
+    longitude REAL
+);
+CREATE INDEX IF NOT EXISTS photos_taken ON photos (taken);
+CREATE INDEX IF NOT EXISTS photos_directory ON photos (directory);
+"""
+
+#---------------------------------------------------------------------------------------------------
+# EXIF
+#---------------------------------------------------------------------------------------------------
+
+def gps_coordinate(gps, value_tag, ref_tag):
+    """Convert GPS coordinate from degrees, minutes and seconds to signed decimal degrees."""
+    try:
+        (degrees, minutes, seconds) = (float(x) for x in gps[value_tag])
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    value = degrees + minutes / 60 + seconds / 3600
+    return -value if gps.get(ref_tag) in ('S', 'W') else value
+
+
+def read_exif(path):
+    """Read EXIF of the photo, only the header is read, not the image data.
+
+    Returns:
+    Tuple (taken, camera, latitude, longitude), where taken is 'YYYY-MM-DD HH:MM:SS'. Missing
+    values are None.
+    """
+    try:
+        with Image.open(path) as img:
+            exif = img.getexif()
+            datetime = exif.get(EXIF_DATETIME) or exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL)
+            camera = exif.get(EXIF_MODEL) or exif.get(EXIF_MAKE)
+            gps = exif.get_ifd(GPS_IFD)
+    except (OSError, SyntaxError, ValueError):
+        return (None, None, None, None)
+
+    taken = None
+    match = EXIF_DATETIME_REGEX.match(str(datetime or ''))
+    if match and match.group(1) != '0000':
+        taken = '%s-%s-%s %s:%s:%s' % match.groups()
+    camera = str(camera).strip('\x00 ') or None if camera else None
+    return (taken, camera, gps_coordinate(gps, GPS_LATITUDE, GPS_LATITUDE_REF),
+            gps_coordinate(gps, GPS_LONGITUDE, GPS_LONGITUDE_REF))
+
+#---------------------------------------------------------------------------------------------------
+# Index
+#---------------------------------------------------------------------------------------------------
+
+def open_index(db_path):
+    """Open the index database, create it if it doesn't exist."""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def scan_photos(root_dir, rel_dir=''):
+    """Yield tuples (path, mtime_ns, size) of all photos in the tree, paths are relative
+    to the root folder.
+    """
+    with os.scandir(os.path.join(root_dir, rel_dir)) as entries:
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name)
+            if entry.is_dir():
+                yield from scan_photos(root_dir, rel_path)
+            elif entry.is_file() and entry.name.lower().endswith(PHOTO_EXTENSIONS):
+                stat = entry.stat()
+                yield (rel_path, stat.st_mtime_ns, stat.st_size)
+
+
+def update_index(conn, root_dir, max_workers=1):
+    """Bring the index up to date with the photos in the tree. EXIF is read only for new
+    and modified photos, removed photos are dropped from the index.
+
+    Returns:
+    Tuple (number of updated photos, number of removed photos).
+    """
+    known = {x[0]: (x[1], x[2]) for x in conn.execute('SELECT path, mtime_ns, size FROM photos')}
+    found = list(scan_photos(root_dir))
+    changed = [x for x in found if known.get(x[0]) != (x[1], x[2])]
+    removed = known.keys() - {x[0] for x in found}
+
+    paths = [os.path.join(root_dir, x[0]) for x in changed]
+    if max_workers == 1:
+        exifs = map(read_exif, paths)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            exifs = list(executor.map(read_exif, paths))
+
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((path, os.path.dirname(path), mtime_ns, size, *exif)
+             for (path, mtime_ns, size), exif in zip(changed, exifs)))
+        conn.executemany('DELETE FROM photos WHERE path = ?', ((x,) for x in removed))
+
+    return (len(changed), len(removed))
+
+#---------------------------------------------------------------------------------------------------
+# Renaming
+#---------------------------------------------------------------------------------------------------
+
+def in_year_directory(path):
+    """Check whether the path is in a top level directory starting with a year."""
+    parts = path.split(os.sep)
+    return len(parts) > 1 and parts[0].startswith('20')
+
+
+def rename_photos(conn, root_dir, dry_run=False):
+    """Rename photos to original names assigned by Samsung smartphone, per their datetime
+    in the index.
+    """
+    rows = conn.execute('SELECT path, taken FROM photos ORDER BY path').fetchall()
+    for path, taken in rows:
+        if not in_year_directory(path):
+            continue
+        full_path = os.path.join(root_dir, path)
+        if taken is None:
+            print(f'{full_path};no datetime')
+            continue
+
+        # build new filename to resemble the original assigned by the Samsung smartphone
+        new_filename = taken.replace('-', '').replace(':', '').replace(' ', '_') + '.jpg'
+        new_path = os.path.join(os.path.dirname(path), new_filename)
+        new_full_path = os.path.join(root_dir, new_path)
 
-def rename_photo_to_samsung_original(path):
-    """Renames photo to original name assigned by Samsung smartphone.
+        # prevent renaming photos which still have the original name
+        old_filename = os.path.basename(path)
+        photo_needs_rename = (old_filename[0:4] != new_filename[0:4])
+
+        # rename the file and print report
+        if not photo_needs_rename:
+            print(f'{full_path};preserved')
+        elif os.path.exists(new_full_path):
+            print(f'{full_path};exists;{new_full_path}')
+        else:
+            if not dry_run:
+                os.rename(full_path, new_full_path)
+                with conn:
+                    conn.execute('UPDATE photos SET path = ? WHERE path = ?', (new_path, path))
+            print(f'{full_path};renamed;{new_full_path}')
+
+
+def directory_name(name, first, last):
+    """Build directory name from the date range of its photos and the description from
+    the current name, eg. '20161010-20161024 Vietnam'.
 
     Args:
-    path: Path to the image file.
-    """
-    # get datetime from image EXIF
-    with Image.open(path) as img:
-        img_exif = img.getexif()
-        datetime = img_exif[306] # '2016:10:10 11:29:05'
-    
-    # build new filename to resemble the original assigned by the Samsung smartphone
-    new_filename = datetime.replace(':', '').replace(' ', '_') + '.jpg'
-    new_path = os.path.join(os.path.dirname(path), new_filename)
-
-    # prevent renaming photos which still have the original name
-    old_filename = os.path.basename(path)
-    photo_needs_rename = (old_filename[0:4] != new_filename[0:4])
-
-    # rename the file and print report
-    if photo_needs_rename:
-        os.rename(path, new_path)
-        print(f'{path};renamed;{new_path}')
+    name: Current name of the directory, eg. '2016-10 Vietnam' or '2016-10 - 2016-11 Vietnam',
+        it has to start with a date matching DIR_DATE_REGEX.
+    first, last: Dates of the first and last photo, 'YYYY-MM-DD'.
+    """
+    description = name[DIR_DATE_REGEX.match(name).end():].lstrip(' _.-')
+    date_range = first.replace('-', '')
+    if last != first:
+        date_range += '-' + last.replace('-', '')
+    return f'{date_range} {description}'.rstrip()
+
+
+def directory_ranges(conn):
+    """Return dict directory -> (first date, last date) of the photos in the directory and
+    its subdirectories.
+    """
+    ranges = {}
+    rows = conn.execute('SELECT directory, MIN(taken), MAX(taken) FROM photos'
+                        ' WHERE taken IS NOT NULL GROUP BY directory')
+    for directory, first, last in rows:
+        (first, last) = (first[:10], last[:10])
+        while directory:
+            (old_first, old_last) = ranges.get(directory, (first, last))
+            ranges[directory] = (min(first, old_first), max(last, old_last))
+            directory = os.path.dirname(directory)
+    return ranges
+
+
+def rename_directories(conn, root_dir, dry_run=False):
+    """Rename directories starting with a year per the date range of their photos."""
+    ranges = directory_ranges(conn)
+
+    # deepest directories first, so the paths of their parents stay valid
+    for directory in sorted(ranges, key=lambda x: (-x.count(os.sep), x)):
+        name = os.path.basename(directory)
+        if not DIR_DATE_REGEX.match(name):
+            continue
+        new_directory = os.path.join(os.path.dirname(directory),
+                                     directory_name(name, *ranges[directory]))
+        full_path = os.path.join(root_dir, directory)
+        new_full_path = os.path.join(root_dir, new_directory)
+
+        if new_directory == directory:
+            print(f'{full_path};preserved')
+        elif os.path.exists(new_full_path):
+            print(f'{full_path};exists;{new_full_path}')
+        else:
+            if not dry_run:
+                os.rename(full_path, new_full_path)
+                prefix = directory + os.sep
+                with conn:
+                    conn.execute(
+                        'UPDATE photos SET path = ? || substr(path, ?),'
+                        ' directory = ? || substr(directory, ?)'
+                        ' WHERE directory = ? OR substr(directory, 1, ?) = ?',
+                        (new_directory, len(directory) + 1, new_directory, len(directory) + 1,
+                         directory, len(prefix), prefix))
+            print(f'{full_path};renamed;{new_full_path}')
+
+#---------------------------------------------------------------------------------------------------
+# Queries
+#---------------------------------------------------------------------------------------------------
+
+def parse_date(text):
+    """Parse date 'YYYY-MM-DD' or 'YYYYMMDD' to 'YYYY-MM-DD'."""
+    match = re.match(r'^(\d{4})-?(\d{2})-?(\d{2})$', text)
+    if not match:
+        raise ValueError(f'Invalid date \'{text}\'')
+    return '%s-%s-%s' % match.groups()
+
+
+def query_photos(conn, first, last):
+    """Return rows (path, taken, camera, latitude, longitude) of photos taken between
+    the dates 'YYYY-MM-DD', inclusive, sorted by datetime.
+    """
+    return conn.execute(
+        'SELECT path, taken, camera, latitude, longitude FROM photos'
+        ' WHERE taken BETWEEN ? AND ? ORDER BY taken, path',
+        (first + ' 00:00:00', last + ' 23:59:59')).fetchall()
+
+
+def directory_date_range(name):
+    """Parse the date range from the directory name, eg. '2016-10 Vietnam' is
+    ('2016-10-01', '2016-10-31'). Missing month or day means the whole year or month.
+
+    Returns:
+    Tuple (first, last) of dates 'YYYY-MM-DD', or None if the name has no date.
+    """
+    match = DIR_DATE_REGEX.match(name)
+    if not match:
+        return None
+    (year, month, day, year2, month2, day2) = match.groups()
+    first = f'{year}-{month or "01"}-{day or "01"}'
+    if year2:
+        last = f'{year2}-{month2 or "12"}-{day2 or "31"}'
     else:
-        print(f'{path};preserved')
+        last = f'{year}-{month or "12"}-{day or "31"}'
+    return (first, last)
+
+
+def check_directories(conn):
+    """Find photos taken outside the date range given by the name of their directory,
+    or of the nearest parent directory with a date.
+
+    Returns:
+    List of tuples (path, taken, (first, last)).
+    """
+    ranges = {}
+    def find_range(directory):
+        if directory not in ranges:
+            date_range = directory_date_range(os.path.basename(directory))
+            if date_range is None and directory:
+                date_range = find_range(os.path.dirname(directory))
+            ranges[directory] = date_range
+        return ranges[directory]
+
+    result = []
+    rows = conn.execute('SELECT path, directory, taken FROM photos'
+                        ' WHERE taken IS NOT NULL ORDER BY path')
+    for path, directory, taken in rows:
+        date_range = find_range(directory)
+        if date_range is not None and not date_range[0] <= taken[:10] <= date_range[1]:
+            result.append((path, taken, date_range))
+    return result
+
+#---------------------------------------------------------------------------------------------------
+# Main
+#---------------------------------------------------------------------------------------------------
+
+def main():
+    root_dir = '.'
+    db_path = None
+    dry_run = False
+    max_workers = 1
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hr:d:nj:')
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(__doc__)
+            sys.exit()
+        elif opt == '-r':
+            root_dir = arg
+        elif opt == '-d':
+            db_path = arg
+        elif opt == '-n':
+            dry_run = True
+        elif opt == '-j':
+            max_workers = int(arg)
+
+    command = args[0] if len(args) > 0 else 'fix'
+    if command not in ('fix', 'photos', 'dirs', 'index', 'query', 'check') or \
+            (command == 'query') != (2 <= len(args) <= 3):
+        print(__doc__)
+        sys.exit(2)
+
+    if db_path is None:
+        db_path = os.path.join(root_dir, DEFAULT_DATABASE)
+    conn = open_index(db_path)
+    (updated, removed) = update_index(conn, root_dir, max_workers)
+    if command == 'index':
+        print(f'Index updated: {updated} photo(s) read, {removed} removed.')
+
+    if command in ('fix', 'photos'):
+        rename_photos(conn, root_dir, dry_run)
+    if command in ('fix', 'dirs'):
+        rename_directories(conn, root_dir, dry_run)
+
+    if command == 'query':
+        try:
+            first = parse_date(args[1])
+            last = parse_date(args[2]) if len(args) > 2 else first
+        except ValueError as e:
+            print(f'ERROR: {e}')
+            sys.exit(2)
+        for path, taken, camera, latitude, longitude in query_photos(conn, first, last):
+            position = f'{latitude:.6f},{longitude:.6f}' if latitude is not None and \
+                longitude is not None else ''
+            print(f'{os.path.join(root_dir, path)};{taken};{camera or ""};{position}')
+
+    if command == 'check':
+        for path, taken, (first, last) in check_directories(conn):
+            print(f'{os.path.join(root_dir, path)};{taken};out of range {first} - {last}')
+
+    conn.close()
 
 
-for root, dirs, files in os.walk('.'):
-    # process only directories starting with a year
-    if root.startswith(r'.\20'):
-        files = [f for f in files if f.lower().endswith('.jpg')]
-        for filename in files:
-            path = os.path.join(root, filename)
-            rename_photo_to_samsung_original(path)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
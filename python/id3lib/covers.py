@@ -0,0 +1,271 @@
+"""
+Content-addressed store of cover art of the MP3 library.
+
+Every track carries its own copy of the cover in APIC frame. The store keeps every distinct
+image just once, in file named by SHA-256 of its content, and an index mapping the tracks
+(relative to the library root) to the hashes of their covers:
+
+  <store_dir>/index.json
+  <store_dir>/ab/abcdef...0123.jpg
+
+Covers are extracted by the lean ID3v2 reader, only the tag region of every file is mapped to
+memory and no mutagen objects are built. Re-embedding is driven by the index: the image of every
+album is read once and its APIC frame is serialized once, then it is written to the tracks whose
+cover differs, without parsing their other frames.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party libraries
+from mutagen.id3 import Encoding, PictureType, ID3, APIC, ID3NoHeaderError
+
+from . import id3v2
+from .id3 import find_mp3_files
+from .profiling import profiler
+
+# file extensions of the stored images per their MIME type
+MIME_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+}
+
+INDEX_VERSION = 1
+
+
+def parse_apic(data):
+    """Parse data of APIC frame.
+
+    Returns:
+    Tuple (mime, picture_type, image), where image is a memoryview of the data, not a copy.
+
+    Raises:
+    ValueError: The frame is malformed.
+    """
+    encoding = data[0]
+    mime_end = data.index(b'\x00', 1)
+    mime = bytes(data[1:mime_end]).decode('latin-1').lower()
+    picture_type = data[mime_end + 1]
+
+    # description is terminated by null character, 2 bytes long in UTF-16
+    pos = mime_end + 2
+    if encoding in (1, 2):
+        while pos + 2 <= len(data) and data[pos:pos + 2] != b'\x00\x00':
+            pos += 2
+        if pos + 2 > len(data):
+            raise ValueError('unterminated description in APIC frame')
+        pos += 2
+    else:
+        pos = data.index(b'\x00', pos) + 1
+    return (mime, picture_type, memoryview(data)[pos:])
+
+
+def is_front_cover(data):
+    """Check whether data of APIC frame are a front cover. Malformed frames are not."""
+    try:
+        return parse_apic(data)[1] == id3v2.PICTURE_FRONT_COVER
+    except (ValueError, IndexError):
+        return False
+
+
+def read_cover(path):
+    """Read the front cover of the MP3 file, or its first picture if there is no front cover.
+
+    Returns:
+    Tuple (mime, image), or None if the file has no picture.
+    """
+    try:
+        pictures = [parse_apic(x) for x in id3v2.read_frame_list(path, 'APIC')]
+        if not pictures:
+            return None
+        (mime, _, image) = next((x for x in pictures if x[1] == id3v2.PICTURE_FRONT_COVER),
+                                pictures[0])
+        return (mime, image)
+    except (id3v2.UnsupportedTagError, ValueError, IndexError):
+        pass
+
+    # fallback for tags which the lean reader doesn't handle
+    try:
+        pictures = ID3(path).getall('APIC')
+    except ID3NoHeaderError:
+        return None
+    if not pictures:
+        return None
+    picture = next((x for x in pictures if x.type == PictureType.COVER_FRONT), pictures[0])
+    return (picture.mime.lower(), picture.data)
+
+
+def embed_cover(path, apic):
+    """Replace the front cover of the MP3 file by the APIC frame. Other pictures (back cover,
+    artist, ...) are kept.
+
+    Args:
+    path: Path to the MP3 file.
+    apic: Tuple (serialized APIC frame, mime, image), the frame is written directly to ID3v2.4
+        tags, mutagen is used for the others.
+    """
+    (frame, mime, image) = apic
+    try:
+        id3v2.replace_frames(path, 'APIC', frame, keep=lambda x: not is_front_cover(x))
+        return
+    except id3v2.UnsupportedTagError:
+        pass
+
+    try:
+        tags = ID3(path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    for key in [k for k, v in tags.items() if k.startswith('APIC') and
+                v.type == PictureType.COVER_FRONT]:
+        del tags[key]
+    tags.add(APIC(encoding=Encoding.UTF8, mime=mime, type=PictureType.COVER_FRONT,
+                  data=bytes(image)))
+    tags.save(path, v2_version=4)
+
+
+class CoverStore:
+    """Directory with images named by hashes of their content and index of tracks."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, 'index.json')
+        self.covers = {}    # hash -> {'mime': ..., 'size': ...}
+        self.tracks = {}    # track path -> hash
+        self.lock = threading.Lock()
+
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'rt', encoding='utf-8') as fobj:
+                index = json.load(fobj)
+            self.covers = index['covers']
+            self.tracks = index['tracks']
+
+
+    def cover_path(self, digest):
+        """Return path of the stored image."""
+        extension = MIME_EXTENSIONS.get(self.covers[digest]['mime'], '.bin')
+        return os.path.join(self.store_dir, digest[:2], digest + extension)
+
+
+    def add(self, image, mime):
+        """Add image to the store, unless it is already there.
+
+        Returns:
+        Hash of the image.
+        """
+        digest = hashlib.sha256(image).hexdigest()
+        with self.lock:
+            if digest in self.covers:
+                return digest
+            self.covers[digest] = {'mime': mime, 'size': len(image)}
+
+        path = self.cover_path(digest)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as fobj:
+                fobj.write(image)
+            os.replace(path + '.tmp', path)
+            profiler.count('bytes_written', len(image))
+        return digest
+
+
+    def read(self, digest):
+        """Read the stored image."""
+        with open(self.cover_path(digest), 'rb') as fobj:
+            return fobj.read()
+
+
+    def save(self):
+        """Save the index, covers which aren't used by any track are dropped from it."""
+        used = set(self.tracks.values())
+        index = {
+            'version': INDEX_VERSION,
+            'covers': {k: v for k, v in sorted(self.covers.items()) if k in used},
+            'tracks': dict(sorted(self.tracks.items())),
+        }
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.index_path + '.tmp', 'wt', encoding='utf-8') as fobj:
+            json.dump(index, fobj, ensure_ascii=False, indent=1)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+
+def extract_covers(root_dir, store, max_workers=None):
+    """Extract covers of all MP3 files in the directory tree to the store and update its index.
+
+    Returns:
+    Tuple (number of tracks with cover, number of tracks without cover).
+    """
+
+    def extract(path):
+        with profiler.stage('cover_extract', path):
+            cover = read_cover(path)
+            if cover is None:
+                return (path, None)
+            return (path, store.add(cover[1], cover[0]))
+
+    counts = [0, 0]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for path, digest in executor.map(extract, find_mp3_files(root_dir)):
+            track = os.path.relpath(path, root_dir)
+            if digest is None:
+                store.tracks.pop(track, None)
+                counts[1] += 1
+            else:
+                store.tracks[track] = digest
+                counts[0] += 1
+    return tuple(counts)
+
+
+def embed_covers(root_dir, store, max_workers=None, dry_run=False):
+    """Embed covers to all tracks per the index of the store. Tracks which already have the right
+    cover are not written. Every album (folder) reads its cover(s) once and all its tracks share
+    the serialized APIC frame.
+
+    Returns:
+    List of paths of the tracks which have been (or would be) written.
+    """
+
+    albums = {}
+    for track, digest in store.tracks.items():
+        path = os.path.join(root_dir, track)
+        if os.path.isfile(path):
+            albums.setdefault(os.path.dirname(path), []).append((path, digest))
+
+    def embed(path, digest, apics):
+        cover = read_cover(path)
+        if cover is not None and hashlib.sha256(cover[1]).hexdigest() == digest:
+            return None
+        if not dry_run:
+            with profiler.stage('cover_embed', path):
+                embed_cover(path, apics[digest])
+            profiler.count('files_written')
+        return path
+
+    written = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for album_dir in sorted(albums):
+            apics = {}
+            for digest in {x[1] for x in albums[album_dir]}:
+                image = store.read(digest)
+                mime = store.covers[digest]['mime']
+                apics[digest] = (id3v2.apic_frame(image, mime), mime, image)
+            written += [x for x in executor.map(lambda x: embed(*x, apics), albums[album_dir])
+                        if x is not None]
+    return written
+
+
+def replace_cover(store, old_digest, image, mime='image/jpeg'):
+    """Add new image to the store and point all tracks with the old cover to it.
+
+    Returns:
+    Number of the tracks pointed to the new image.
+    """
+    digest = store.add(image, mime)
+    tracks = [k for k, v in store.tracks.items() if v == old_digest]
+    for track in tracks:
+        store.tracks[track] = digest
+    return len(tracks)
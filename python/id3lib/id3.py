@@ -1,27 +1,132 @@
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 # 3rd party libraries
-from mutagen.id3 import Encoding, PictureType, ID3, APIC, TALB, TDRC, TIT2, TPE1, TPE2, TRCK
+from mutagen.id3 import Encoding, Frames, ID3, ID3NoHeaderError
+
+from . import id3v2
+
+# fields which can be used in filename templates: name -> (frame ID, regex)
+TEMPLATE_FIELDS = {
+    'track':  ('TRCK', r'\d+'),
+    'artist': ('TPE1', r'.+?'),
+    'title':  ('TIT2', r'.+?'),
+    'album':  ('TALB', r'.+?'),
+    'year':   ('TDRC', r'\d{4}'),
+}
+
+DEFAULT_TEMPLATES = ['{track} {title}']
+
+
+def literal_regex(text):
+    """Convert literal part of a template to regex, any whitespace matches any whitespace."""
+    return ''.join(r'\s+' if x.isspace() else re.escape(x) for x in re.split(r'(\s+)', text) if x)
+
+
+def compile_template(template):
+    """Compile a filename template, eg. '{track} {artist} - {title}', to a regex matching
+    the whole filename including the extension '.mp3'. Fields are listed in TEMPLATE_FIELDS.
+    """
+    parts = re.split(r'\{(\w+)\}', template)
+    pattern = '^' + literal_regex(parts[0])
+    for field, literal in zip(parts[1::2], parts[2::2]):
+        if field not in TEMPLATE_FIELDS:
+            raise ValueError(f'unknown field \'{field}\'')
+        pattern += f'(?P<{field}>{TEMPLATE_FIELDS[field][1]})' + literal_regex(literal)
+    return re.compile(pattern + r'\.mp3$', re.IGNORECASE)
+
+
+DEFAULT_PATTERNS = [compile_template(x) for x in DEFAULT_TEMPLATES]
+
+
+def parse_filename(mp3_path, patterns=DEFAULT_PATTERNS):
+    """Parse filename of the MP3 file with the first matching pattern.
+
+    Returns:
+    Dict of frame ID -> value, or None if no pattern matches.
+    """
+    filename = os.path.basename(mp3_path)
+    for pattern in patterns:
+        match = pattern.match(filename)
+        if match:
+            return {TEMPLATE_FIELDS[k][0]: v.strip() for k, v in match.groupdict().items()}
+    return None
+
+
+def import_file(mp3_path, patterns=DEFAULT_PATTERNS, dry_run=False):
+    """Import ID3 tags of the MP3 file from its filename. The file is written only if the tags
+    differ from the parsed values.
+
+    Args:
+    mp3_path: Path to the MP3 file.
+    patterns: Compiled patterns, see compile_template().
+    dry_run: If True, nothing is written, only the differences are returned.
+
+    Returns:
+    Tuple (mp3_path, changes), where changes is a dict of frame ID -> (old value, new value),
+    or None if the filename couldn't be parsed.
+    """
+    values = parse_filename(mp3_path, patterns)
+    if values is None:
+        return (mp3_path, None)
+
+    current = id3v2.read_text_frames(mp3_path, values.keys())
+    changes = {k: (current.get(k), v) for k, v in values.items() if current.get(k) != v}
+
+    if changes and not dry_run:
+        try:
+            tags = ID3(mp3_path)
+        except ID3NoHeaderError:
+            tags = ID3()
+        for frame_id, (_, value) in changes.items():
+            tags[frame_id] = Frames[frame_id](encoding=Encoding.UTF8, text=value)
+        tags.save(mp3_path)
+
+    return (mp3_path, changes)
+
+
+def find_mp3_files(root_dir):
+    """Yield paths of all MP3 files in the directory tree, in sorted order."""
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith('.mp3'):
+                yield os.path.join(dirpath, filename)
+
+
+def import_from_filenames(root_dir='.', templates=DEFAULT_TEMPLATES, dry_run=False,
+                          max_workers=None):
+    """Import ID3 tags from filenames of all MP3 files in the directory tree, on a thread pool.
+    The templates are compiled once for all files.
+
+    Args:
+    root_dir: Root of the directory tree.
+    templates: Filename templates, the first matching one is used for each file.
+    dry_run: If True, nothing is written, only the differences are returned.
+    max_workers: Number of threads, defaults to ThreadPoolExecutor's default.
+
+    Returns:
+    Iterator of results of import_file(), in order of the files.
+    """
+    patterns = [compile_template(x) for x in templates]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(lambda x: import_file(x, patterns, dry_run),
+                                find_mp3_files(root_dir))
 
 
 def import_id3_from_filename(mp3_path):
-    pattern = r'^(\d+)\s+(.+)\.mp3$'
-    match = re.match(pattern, mp3_path)
-    if match:
-        track_number = match.group(1)
-        track_name = match.group(2)
-        tags = ID3(mp3_path)
-        tags['TRCK'] = TRCK(encoding=Encoding.UTF8, text=track_number)
-        tags['TIT2'] = TIT2(encoding=Encoding.UTF8, text=track_name)
-        tags.save()
-        print(f'{mp3_path}: imported track number {track_number} and title "{track_name}"')
-    else:
+    (_, changes) = import_file(mp3_path)
+    if changes is None:
         print(f'{mp3_path}: could not parse filename')
+    elif not changes:
+        print(f'{mp3_path}: tags already match the filename')
+    else:
+        values = parse_filename(mp3_path)
+        print(f'{mp3_path}: imported track number {values["TRCK"]} and title "{values["TIT2"]}"')
 
 
 def process_file(mp3_path):
     tags = ID3(mp3_path)
     track_title = tags['TIT2'].text[0]
     print(track_title)
-
-
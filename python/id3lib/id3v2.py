@@ -0,0 +1,307 @@
+"""
+Low-level serialization and reading of ID3v2 tags, without building mutagen objects.
+
+The frames are plain bytes, so frames shared by several files (eg. album and cover) can be
+serialized once and reused for every file. The reader walks just the frame headers and decodes
+only the requested frames, which is much faster than full parsing by mutagen. Frames can be
+replaced the same way, the other frames are copied verbatim.
+"""
+
+import mmap
+import os
+
+# 3rd party libraries
+from mutagen.id3 import ID3, ID3NoHeaderError
+
+from .profiling import profiler
+
+# text encoding byte of ID3v2.4 frames
+ENCODING_UTF8 = 3
+
+# picture type of front cover in APIC frame
+PICTURE_FRONT_COVER = 3
+
+# codecs of text encodings, indexed by the encoding byte
+TEXT_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+# text frames read by default
+TEXT_FRAME_IDS = ('TRCK', 'TIT2', 'TPE1', 'TPE2', 'TALB', 'TDRC')
+
+
+#---------------------------------------------------------------------------------------------------
+# Writing
+#---------------------------------------------------------------------------------------------------
+
+def syncsafe(value):
+    """Encode an integer as 4 bytes syncsafe integer (7 bits per byte)."""
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def frame(frame_id, data):
+    """Build a ID3v2.4 frame from frame ID and raw frame data."""
+    return frame_id.encode('ascii') + syncsafe(len(data)) + b'\x00\x00' + data
+
+
+def text_frame(frame_id, text):
+    """Build a text frame (TIT2, TPE1, ...) encoded in UTF-8.
+
+    Returns:
+    The frame as bytes, or empty bytes if the text is empty.
+    """
+    if not text:
+        return b''
+    return frame(frame_id, bytes([ENCODING_UTF8]) + text.encode('utf-8'))
+
+
+def apic_frame(data, mime='image/jpeg', picture_type=PICTURE_FRONT_COVER, description=''):
+    """Build an attached picture frame."""
+    header = bytes([ENCODING_UTF8]) + mime.encode('ascii') + b'\x00' + \
+             bytes([picture_type]) + description.encode('utf-8') + b'\x00'
+    return frame('APIC', header + data)
+
+
+def txxx_frame(description, text):
+    """Build a user defined text frame, eg. REPLAYGAIN_TRACK_GAIN."""
+    return frame('TXXX', bytes([ENCODING_UTF8]) + description.encode('utf-8') + b'\x00' +
+                 text.encode('utf-8'))
+
+
+def tag(*frames, padding=0):
+    """Build a complete ID3v2.4 tag from already serialized frames.
+
+    Args:
+    frames: Serialized frames, each item can contain several concatenated frames.
+    padding: Number of zero bytes appended after the frames, for later in-place edits.
+    """
+    body = b''.join(frames) + bytes(padding)
+    return b'ID3\x04\x00\x00' + syncsafe(len(body)) + body
+
+
+#---------------------------------------------------------------------------------------------------
+# Reading
+#---------------------------------------------------------------------------------------------------
+
+class UnsupportedTagError(Exception):
+    """Raised for tags which the lean reader doesn't handle (ID3v2.2, unsynchronisation,
+    compressed or encrypted frames, ...). Those are left to mutagen."""
+
+
+def unsyncsafe(data):
+    """Decode 4 bytes syncsafe integer."""
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def read_header(fobj):
+    """Read header of the ID3v2 tag at the beginning of the file.
+
+    Returns:
+    Tuple (version, flags, end), where end is the offset of the first byte after the tag, or None
+    if the file has no ID3v2 tag.
+
+    Raises:
+    UnsupportedTagError: The tag uses a feature not supported by this reader.
+    """
+    header = fobj.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return None
+
+    version = header[3]
+    flags = header[5]
+    if version not in (3, 4):
+        raise UnsupportedTagError(f'ID3v2.{version} tag')
+    if flags & 0x80:
+        raise UnsupportedTagError('unsynchronised tag')
+    end = 10 + unsyncsafe(header[6:10])
+    if end > os.fstat(fobj.fileno()).st_size:
+        raise UnsupportedTagError('truncated tag')
+    return (version, flags, end)
+
+
+def walk_frames(buf, version, flags, end):
+    """Walk through frame headers of a tag mapped in the buffer.
+
+    Yields:
+    Tuples (frame ID, offset of frame data, size of frame data, unsupported flags), where
+    unsupported flags are non-zero for compressed, encrypted or unsynchronised frames.
+    """
+    pos = 10
+
+    # skip extended header
+    if flags & 0x40:
+        if version == 4:
+            pos += unsyncsafe(buf[pos:pos + 4])
+        else:
+            pos += 4 + int.from_bytes(buf[pos:pos + 4], 'big')
+
+    while pos + 10 <= end:
+        frame_id = buf[pos:pos + 4]
+        if frame_id[0] == 0:
+            break  # padding
+        if version == 4:
+            frame_size = unsyncsafe(buf[pos + 4:pos + 8])
+            unsupported_flags = buf[pos + 9] & 0x4F
+        else:
+            frame_size = int.from_bytes(buf[pos + 4:pos + 8], 'big')
+            unsupported_flags = buf[pos + 9] & 0xE0
+        pos += 10
+        if pos + frame_size > end:
+            raise UnsupportedTagError('frame exceeds the tag')
+        yield (frame_id.decode('latin-1'), pos, frame_size, unsupported_flags)
+        pos += frame_size
+
+
+def read_frames(path, frame_ids):
+    """Read raw data of the requested frames from the ID3v2 tag of a file. Only the tag region
+    of the file is mapped to memory and only frame headers are walked through, data are copied
+    out just for the requested frames. If a frame is present more times, the first one is taken.
+
+    Args:
+    path: Path to the MP3 file.
+    frame_ids: Collection of IDs of the requested frames.
+
+    Returns:
+    Dict of frame ID -> frame data as bytes. Empty dict if the file has no ID3v2 tag.
+
+    Raises:
+    UnsupportedTagError: The tag uses a feature not supported by this reader.
+    """
+
+    frames = {}
+    with open(path, 'rb') as fobj:
+        header = read_header(fobj)
+        if header is None or header[2] == 10:
+            return frames
+        (version, flags, end) = header
+
+        profiler.count('tag_bytes_mapped', end)
+        with mmap.mmap(fobj.fileno(), end, access=mmap.ACCESS_READ) as buf:
+            for frame_id, pos, frame_size, bad_flags in walk_frames(buf, version, flags, end):
+                if frame_id in frame_ids and frame_id not in frames:
+                    if bad_flags:
+                        raise UnsupportedTagError(f'unsupported flags of frame {frame_id}')
+                    frames[frame_id] = buf[pos:pos + frame_size]
+
+    return frames
+
+
+def read_frame_list(path, frame_id):
+    """Read raw data of all frames with the frame ID (eg. all APIC frames), in order of the tag.
+
+    Returns:
+    List of frame data as bytes, empty if there is no such frame or no ID3v2 tag.
+
+    Raises:
+    UnsupportedTagError: The tag uses a feature not supported by this reader.
+    """
+
+    frames = []
+    with open(path, 'rb') as fobj:
+        header = read_header(fobj)
+        if header is None or header[2] == 10:
+            return frames
+        (version, flags, end) = header
+
+        profiler.count('tag_bytes_mapped', end)
+        with mmap.mmap(fobj.fileno(), end, access=mmap.ACCESS_READ) as buf:
+            for fid, pos, frame_size, bad_flags in walk_frames(buf, version, flags, end):
+                if fid == frame_id:
+                    if bad_flags:
+                        raise UnsupportedTagError(f'unsupported flags of frame {frame_id}')
+                    frames.append(buf[pos:pos + frame_size])
+
+    return frames
+
+
+def replace_frames(path, frame_id, new_frames, padding=1024, keep=None):
+    """Replace frames with the frame ID in the ID3v2.4 tag of a file by new frames, without
+    parsing the other frames, they are copied verbatim. If the new tag fits in the space of
+    the old one (including its padding), it is written in place, otherwise the file is rewritten
+    with the new tag and the given padding.
+
+    Args:
+    path: Path to the MP3 file.
+    frame_id: ID of the replaced frames, eg. 'APIC'.
+    new_frames: Serialized new frames, can be empty to just remove the frames.
+    padding: Padding of the new tag if the file is rewritten.
+    keep: Function getting data of a frame with the frame ID, frames for which it returns True
+        are kept. By default all frames with the frame ID are replaced.
+
+    Raises:
+    UnsupportedTagError: The file has other than ID3v2.4 tag or one with extended header or
+        footer. Those are left to mutagen.
+    """
+
+    with open(path, 'r+b') as fobj:
+        header = read_header(fobj)
+        if header is None:
+            raise UnsupportedTagError('no ID3v2 tag')
+        (version, flags, end) = header
+        if version != 4:
+            raise UnsupportedTagError(f'ID3v2.{version} tag')
+        if flags & 0x50:
+            raise UnsupportedTagError('extended header or footer')
+
+        fobj.seek(0)
+        buf = fobj.read(end)
+        kept = [buf[pos - 10:pos + size]
+                for fid, pos, size, _ in walk_frames(buf, version, flags, end)
+                if fid != frame_id or (keep is not None and keep(buf[pos:pos + size]))]
+        body_size = sum(len(x) for x in kept) + len(new_frames)
+
+        # in place, padded to the size of the old tag
+        if body_size <= end - 10:
+            fobj.seek(0)
+            fobj.write(tag(*kept, new_frames, padding=end - 10 - body_size))
+            profiler.count('bytes_written', end)
+            return
+
+        # rewrite the whole file with a bigger tag
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as temp:
+            temp.write(tag(*kept, new_frames, padding=padding))
+            fobj.seek(end)
+            for chunk in iter(lambda: fobj.read(1 << 16), b''):
+                temp.write(chunk)
+            profiler.count('bytes_written', temp.tell())
+    os.replace(temp_path, path)
+
+
+def decode_text(data):
+    """Decode data of a text frame, the first value is returned."""
+    if len(data) == 0:
+        return ''
+    if data[0] >= len(TEXT_ENCODINGS):
+        raise UnsupportedTagError(f'unknown text encoding {data[0]}')
+    text = data[1:].decode(TEXT_ENCODINGS[data[0]])
+    return text.split('\x00')[0]
+
+
+def read_text_frames(path, frame_ids=TEXT_FRAME_IDS):
+    """Read the requested text frames from the ID3v2 tag of a file, without parsing the other
+    frames. Tags which can't be handled by the lean reader are read by mutagen. ID3v2.3 frame
+    TYER is returned as TDRC, like mutagen does.
+
+    Args:
+    path: Path to the MP3 file.
+    frame_ids: Collection of IDs of the requested text frames.
+
+    Returns:
+    Dict of frame ID -> text. Frames missing in the tag are missing in the dict too.
+    """
+
+    try:
+        frames = read_frames(path, set(frame_ids) | {'TYER'})
+        if 'TDRC' in frame_ids and 'TDRC' not in frames and 'TYER' in frames:
+            frames['TDRC'] = frames['TYER']
+        return {x: decode_text(frames[x]) for x in frame_ids if x in frames}
+    except (UnsupportedTagError, UnicodeDecodeError):
+        return read_text_frames_mutagen(path, frame_ids)
+
+
+def read_text_frames_mutagen(path, frame_ids=TEXT_FRAME_IDS):
+    """Read the requested text frames by mutagen, returns the same data as read_text_frames()."""
+    try:
+        tags = ID3(path)
+    except ID3NoHeaderError:
+        return {}
+    return {x: str(tags[x].text[0]) for x in frame_ids if x in tags and len(tags[x].text) > 0}
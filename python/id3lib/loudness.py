@@ -0,0 +1,164 @@
+"""
+Loudness measurement per ITU-R BS.1770 / EBU R128 and ReplayGain 2.0 values derived from it.
+
+LoudnessMeter is fed with blocks of PCM samples as they are decoded, so the loudness is measured
+while the audio streams through, without keeping it in memory. All processing is vectorized:
+K-weighting is applied as FFT convolution with the (truncated) impulse response of the filters
+and mean squares are accumulated per 100 ms segments, from which the gated 400 ms blocks are built.
+Only the segment energies are kept per track, so album loudness is computed from the blocks of
+all its tracks, without decoding anything again.
+"""
+
+import math
+from functools import lru_cache
+
+import numpy as np
+
+# ReplayGain 2.0 reference level
+REPLAYGAIN_REFERENCE = -18.0    # LUFS
+
+# gating per BS.1770-4
+BLOCK_SEGMENTS = 4              # gating block of 400 ms consists of 4 segments of 100 ms
+SEGMENT_DURATION = 0.1          # seconds
+ABSOLUTE_GATE = -70.0           # LUFS
+RELATIVE_GATE = -10.0           # LU
+
+# K-weighting filters: (gain [dB], Q, center frequency [Hz]), their design for any sample rate
+# follows libebur128
+KWEIGHTING_SHELF = (3.99984385397, 0.7071752369554193, 1681.9744509555319)
+KWEIGHTING_HIGHPASS = (0.0, 0.5003270373253953, 38.13547087613982)
+KWEIGHTING_IR_DURATION = 0.1    # seconds, the impulse response decays below 1e-9 by then
+
+
+def biquad_shelf(sample_rate, gain, q, freq):
+    """Coefficients (b, a) of the high shelf filter (stage 1 of K-weighting)."""
+    k = math.tan(math.pi * freq / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    b = ((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0)
+    a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+    return (b, a)
+
+
+def biquad_highpass(sample_rate, gain, q, freq):
+    """Coefficients (b, a) of the high pass filter (stage 2 of K-weighting)."""
+    k = math.tan(math.pi * freq / sample_rate)
+    a0 = 1 + k / q + k * k
+    b = (1.0, -2.0, 1.0)
+    a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+    return (b, a)
+
+
+def biquad_response(b, a, signal):
+    """Filter the signal (list of floats) by a biquad with normalized coefficients (a0 = 1)."""
+    (b0, b1, b2) = b
+    (a1, a2) = a[1:]
+    (x1, x2, y1, y2) = (0.0, 0.0, 0.0, 0.0)
+    output = []
+    for x in signal:
+        y = b0 * x + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+        (x1, x2, y1, y2) = (x, x1, y, y1)
+        output.append(y)
+    return output
+
+
+@lru_cache(maxsize=None)
+def kweighting_response(sample_rate):
+    """Impulse response of the K-weighting filter for the sample rate, as NumPy array."""
+    impulse = [1.0] + [0.0] * (round(KWEIGHTING_IR_DURATION * sample_rate) - 1)
+    response = biquad_response(*biquad_shelf(sample_rate, *KWEIGHTING_SHELF), impulse)
+    response = biquad_response(*biquad_highpass(sample_rate, *KWEIGHTING_HIGHPASS), response)
+    return np.array(response)
+
+
+class LoudnessMeter:
+    """Measures loudness and sample peak of a track from blocks of PCM samples."""
+
+    def __init__(self, sample_rate, channels):
+        self.response = kweighting_response(sample_rate)
+        self.spectra = {}
+        self.tail = np.zeros((len(self.response) - 1, channels))
+        self.segment_len = round(SEGMENT_DURATION * sample_rate)
+        self.rest = np.zeros(0)
+        self.segments = []
+        self.peak = 0.0
+
+
+    def add(self, samples):
+        """Add block of samples, NumPy array of shape (frames, channels) in range <-1, 1>."""
+        length = len(samples)
+        if length == 0:
+            return
+        self.peak = max(self.peak, float(np.max(np.abs(samples))))
+
+        # K-weighting by FFT convolution, overlap-add with the tail of the previous block
+        full_length = length + len(self.response) - 1
+        fft_size = 1 << (full_length - 1).bit_length()
+        if fft_size not in self.spectra:
+            self.spectra[fft_size] = np.fft.rfft(self.response, fft_size)[:, np.newaxis]
+        filtered = np.fft.irfft(np.fft.rfft(samples, fft_size, axis=0) * self.spectra[fft_size],
+                                fft_size, axis=0)[:full_length]
+        filtered[:len(self.tail)] += self.tail
+        self.tail = filtered[length:]
+
+        # energy summed over channels, accumulated per segments
+        power = np.concatenate((self.rest, np.sum(np.square(filtered[:length]), axis=1)))
+        count = len(power) // self.segment_len
+        self.segments.append(
+            power[:count * self.segment_len].reshape(count, self.segment_len).sum(axis=1))
+        self.rest = power[count * self.segment_len:]
+
+
+    def block_energies(self):
+        """Return mean square energies of all gating blocks (400 ms, overlapping by 75 %)."""
+        segments = np.concatenate(self.segments) if self.segments else np.zeros(0)
+        if len(segments) < BLOCK_SEGMENTS:
+            return np.zeros(0)
+        blocks = sum(segments[i:len(segments) - BLOCK_SEGMENTS + 1 + i]
+                     for i in range(BLOCK_SEGMENTS))
+        return blocks / (BLOCK_SEGMENTS * self.segment_len)
+
+
+    def loudness(self):
+        """Integrated loudness of the track in LUFS, None for silence."""
+        return integrated_loudness(self.block_energies())
+
+
+def integrated_loudness(energies):
+    """Gated integrated loudness in LUFS from block energies, None if all blocks are gated."""
+    energies = energies[energies > energy(ABSOLUTE_GATE)]
+    if len(energies) == 0:
+        return None
+    energies = energies[energies > energy(loudness(np.mean(energies)) + RELATIVE_GATE)]
+    return loudness(np.mean(energies))
+
+
+def album_loudness(meters):
+    """Integrated loudness of an album in LUFS, from the blocks of all its tracks."""
+    return integrated_loudness(np.concatenate([x.block_energies() for x in meters] or
+                                              [np.zeros(0)]))
+
+
+def loudness(value):
+    """Convert mean square energy to loudness in LUFS."""
+    return -0.691 + 10 * math.log10(value)
+
+
+def energy(value):
+    """Convert loudness in LUFS to mean square energy."""
+    return 10 ** ((value + 0.691) / 10)
+
+
+def replaygain_tags(loudness_value, peak, scope='TRACK'):
+    """Return dict of ReplayGain 2.0 tags for the loudness and peak.
+
+    Args:
+    loudness_value: Integrated loudness in LUFS.
+    peak: Sample peak relative to full scale.
+    scope: 'TRACK' or 'ALBUM'.
+    """
+    return {
+        f'REPLAYGAIN_{scope}_GAIN': f'{REPLAYGAIN_REFERENCE - loudness_value:.2f} dB',
+        f'REPLAYGAIN_{scope}_PEAK': f'{peak:.6f}',
+    }
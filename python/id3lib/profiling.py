@@ -0,0 +1,165 @@
+"""
+Lightweight instrumentation of the MP3 tools: per-stage and per-track timing, counters of bytes
+read and written, optional cProfile dump (*.prof, readable by pstats/snakeviz) or Chrome trace
+(*.json, readable by chrome://tracing or Perfetto).
+
+The module-level 'profiler' is disabled by default and then its stages cost almost nothing.
+Scripts enable it by the command line option handled in parse_argv():
+
+  --profile            Print timing report at exit.
+  --profile=out.prof   Print the report and dump cProfile statistics (main thread only).
+  --profile=out.json   Print the report and dump Chrome trace of all stages.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+
+class Profiler:
+    """Collects durations of named stages, optionally per track, and named counters."""
+
+    def __init__(self):
+        self.enabled = False
+        self.output_path = None
+        self.events = []
+        self.counters = {}
+        self.time_start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.cprofile = None
+
+
+    def enable(self, output_path=None):
+        """Enable collecting of the data.
+
+        Args:
+        output_path: File for cProfile statistics (*.prof) or Chrome trace (*.json), optional.
+        """
+        self.enabled = True
+        self.output_path = output_path
+        self.time_start = time.perf_counter()
+        if output_path is not None and not output_path.endswith('.json'):
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+
+    def stage(self, name, track=None):
+        """Return context manager measuring duration of a stage.
+
+        Args:
+        name: Name of the stage, eg. 'ffmpeg'.
+        track: Path of the track the stage works on, if any.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.__measure(name, track)
+
+
+    def count(self, name, value=1):
+        """Add value to a named counter, eg. 'bytes_read'."""
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def finish(self):
+        """Stop collecting, print the report and dump the output file, if requested."""
+        if not self.enabled:
+            return
+        self.enabled = False
+
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.output_path)
+        elif self.output_path is not None:
+            self.dump_chrome_trace(self.output_path)
+
+        self.print_report()
+        if self.output_path is not None:
+            print(f'Profiling data written to \'{self.output_path}\'.')
+
+
+    def print_report(self, slowest_tracks=10):
+        """Print total time per stage, counters and the slowest tracks."""
+
+        stages = {}
+        tracks = {}
+        for name, track, _, duration, _ in self.events:
+            total = stages.setdefault(name, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+            if track is not None:
+                tracks[track] = tracks.get(track, 0.0) + duration
+
+        wall_time = time.perf_counter() - self.time_start
+        print(f'\nProfile (wall time {wall_time:.3f} s):')
+        print(f'  {"stage":<20} {"count":>8} {"total [s]":>10} {"mean [ms]":>10} {"max [ms]":>10}')
+        for name, (count, total, maximum) in sorted(stages.items(), key=lambda x: -x[1][1]):
+            print(f'  {name:<20} {count:>8} {total:>10.3f} {1000 * total / count:>10.2f}'
+                  f' {1000 * maximum:>10.2f}')
+
+        if self.counters:
+            print('Counters:')
+            for name, value in sorted(self.counters.items()):
+                print(f'  {name:<20} {value:>12}')
+
+        if tracks:
+            print('Slowest tracks:')
+            for track, total in sorted(tracks.items(), key=lambda x: -x[1])[:slowest_tracks]:
+                print(f'  {1000 * total:>10.2f} ms  {track}')
+
+
+    def dump_chrome_trace(self, path):
+        """Dump the stages as Chrome trace JSON file."""
+        pid = os.getpid()
+        trace_events = []
+        for name, track, start, duration, tid in self.events:
+            event = {
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self.time_start) * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': tid,
+            }
+            if track is not None:
+                event['args'] = {'track': track}
+            trace_events.append(event)
+        trace = {'traceEvents': trace_events, 'otherData': {'counters': self.counters}}
+        with open(path, 'wt', encoding='utf-8') as fobj:
+            json.dump(trace, fobj, ensure_ascii=False)
+
+
+    @contextlib.contextmanager
+    def __measure(self, name, track):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.events.append((name, track, start, duration, threading.get_ident()))
+
+
+profiler = Profiler()
+
+
+def parse_argv(argv):
+    """Enable the profiler if option '--profile[=path]' is present in the arguments.
+
+    Returns:
+    The arguments without the option.
+    """
+    remaining = []
+    for arg in argv:
+        if arg == '--profile':
+            profiler.enable()
+        elif arg.startswith('--profile='):
+            profiler.enable(arg[len('--profile='):])
+        else:
+            remaining.append(arg)
+    return remaining
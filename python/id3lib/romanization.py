@@ -0,0 +1,287 @@
+"""
+Helpers for romanization of Asian texts.
+
+detect_language() classifies a string by Unicode scripts of its characters, using precomputed
+tables of code point ranges, so the right romanization engine can be chosen for every string and
+strings which need no transcription skip the engines entirely.
+
+NameDictionary replaces all known names (eg. Chinese names of artists with their English names)
+within a string in a single pass, using Aho-Corasick automaton. The dictionaries are plain text
+files with lines 'original<TAB>romanization', lines starting with '#' are comments. The compiled
+automaton is cached on disk in the home folder of the user, as JSON, so loading a cache cannot
+run any code and even dictionaries with thousands of names load instantly.
+"""
+
+import json
+import os
+from bisect import bisect_right
+
+# version of the cached automaton format, increment when it changes
+CACHE_VERSION = 2
+
+# default cache of the compiled automaton, next to the user's dictionary ~/.romanization_dict.txt
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.romanization_dict.cache.json')
+
+# scripts relevant for romanization, as bit flags
+SCRIPT_HAN = 0x01
+SCRIPT_KANA = 0x02
+SCRIPT_HANGUL = 0x04
+
+# languages detected by detect_language()
+LANGUAGE_CHINESE = 'zh'
+LANGUAGE_JAPANESE = 'ja'
+LANGUAGE_KOREAN = 'ko'
+
+# code point ranges of the scripts, sorted and non-overlapping: (first, last, script)
+SCRIPT_RANGES = [
+    (0x1100, 0x11FF, SCRIPT_HANGUL),    # Hangul Jamo
+    (0x2E80, 0x2FDF, SCRIPT_HAN),       # CJK Radicals, Kangxi Radicals
+    (0x3005, 0x3007, SCRIPT_HAN),       # iteration mark, closing mark, ideographic zero
+    (0x3021, 0x3029, SCRIPT_HAN),       # Hangzhou numerals
+    (0x3038, 0x303B, SCRIPT_HAN),       # Hangzhou numerals, iteration marks
+    (0x3040, 0x309F, SCRIPT_KANA),      # Hiragana
+    (0x30A0, 0x30FF, SCRIPT_KANA),      # Katakana
+    (0x3130, 0x318F, SCRIPT_HANGUL),    # Hangul Compatibility Jamo
+    (0x31F0, 0x31FF, SCRIPT_KANA),      # Katakana Phonetic Extensions
+    (0x3400, 0x4DBF, SCRIPT_HAN),       # CJK Unified Ideographs Extension A
+    (0x4E00, 0x9FFF, SCRIPT_HAN),       # CJK Unified Ideographs
+    (0xA960, 0xA97F, SCRIPT_HANGUL),    # Hangul Jamo Extended-A
+    (0xAC00, 0xD7FF, SCRIPT_HANGUL),    # Hangul Syllables, Hangul Jamo Extended-B
+    (0xF900, 0xFAFF, SCRIPT_HAN),       # CJK Compatibility Ideographs
+    (0xFF66, 0xFF9F, SCRIPT_KANA),      # Halfwidth Katakana
+    (0xFFA0, 0xFFDC, SCRIPT_HANGUL),    # Halfwidth Hangul
+    (0x1B000, 0x1B16F, SCRIPT_KANA),    # Kana Supplement, Kana Extended-A, Small Kana Extension
+    (0x20000, 0x3134F, SCRIPT_HAN),     # CJK Unified Ideographs Extension B-G, Compatibility
+]
+SCRIPT_FIRSTS = [x[0] for x in SCRIPT_RANGES]
+SCRIPT_LASTS = [x[1] for x in SCRIPT_RANGES]
+SCRIPT_FLAGS = [x[2] for x in SCRIPT_RANGES]
+SCRIPT_MIN = SCRIPT_FIRSTS[0]
+
+
+def detect_scripts(text):
+    """Return bit flags SCRIPT_* of the scripts present in the text, in a single scan."""
+    scripts = 0
+    for char in text:
+        code = ord(char)
+        if code < SCRIPT_MIN:
+            continue
+        i = bisect_right(SCRIPT_FIRSTS, code) - 1
+        if code <= SCRIPT_LASTS[i]:
+            scripts |= SCRIPT_FLAGS[i]
+    return scripts
+
+
+def detect_language(text):
+    """Detect language of the text per its scripts. Any kana means Japanese, any hangul means
+    Korean, otherwise Chinese characters mean Chinese.
+
+    Returns:
+    LANGUAGE_* constant, or None if the text doesn't need any transcription.
+    """
+    scripts = detect_scripts(text)
+    if scripts & SCRIPT_KANA:
+        return LANGUAGE_JAPANESE
+    if scripts & SCRIPT_HANGUL:
+        return LANGUAGE_KOREAN
+    if scripts & SCRIPT_HAN:
+        return LANGUAGE_CHINESE
+    return None
+
+
+class NameDictionary:
+    """Aho-Corasick automaton of dictionary names, replacing the leftmost-longest matches."""
+
+    def __init__(self, entries=None):
+        # node 0 is root; for every node: transitions, failure link, dictionary entry ending
+        # at the node as (length, replacement) and link to the next node with an entry which
+        # is a suffix of this one
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        self.dict_link = [0]
+        self.entries = {}
+        if entries:
+            self.build(entries)
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def __contains__(self, text):
+        return text in self.entries
+
+
+    def __getitem__(self, text):
+        return self.entries[text]
+
+
+    def build(self, entries):
+        """Build the automaton from dict of original -> replacement."""
+        self.entries = dict(entries)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        self.dict_link = [0]
+
+        # trie of the entries
+        for original, replacement in self.entries.items():
+            if not original:
+                continue
+            node = 0
+            for char in original:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                    self.dict_link.append(0)
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node] = (len(original), replacement)
+
+        # failure and dictionary links in breadth-first order (children of root fail to root)
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                if self.output[self.fail[child]] is not None:
+                    self.dict_link[child] = self.fail[child]
+                else:
+                    self.dict_link[child] = self.dict_link[self.fail[child]]
+
+
+    def to_state(self):
+        """Return the automaton as dict of plain types, for the cache file."""
+        return {
+            'entries': self.entries,
+            'goto': self.goto,
+            'fail': self.fail,
+            'output': self.output,
+            'dict_link': self.dict_link,
+        }
+
+
+    @classmethod
+    def from_state(cls, state):
+        """Create the automaton from dict returned by to_state(), without building it again."""
+        dictionary = cls()
+        dictionary.entries = state['entries']
+        dictionary.goto = state['goto']
+        dictionary.fail = state['fail']
+        dictionary.output = [None if x is None else tuple(x) for x in state['output']]
+        dictionary.dict_link = state['dict_link']
+        return dictionary
+
+
+    def segments(self, text):
+        """Split the text to segments, in a single pass through it. Dictionary names are
+        matched leftmost, then longest first.
+
+        Returns:
+        List of tuples (segment, replacement), where replacement is None for the segments
+        which are not dictionary names.
+        """
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        dict_link = self.dict_link
+
+        # all matches
+        matches = []
+        node = 0
+        for pos, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            match = node if output[node] is not None else dict_link[node]
+            while match:
+                length, replacement = output[match]
+                matches.append((pos + 1 - length, pos + 1, replacement))
+                match = dict_link[match]
+
+        # leftmost-longest non-overlapping matches
+        matches.sort(key=lambda x: (x[0], -x[1]))
+        segments = []
+        last = 0
+        for start, end, replacement in matches:
+            if start >= last:
+                if start > last:
+                    segments.append((text[last:start], None))
+                segments.append((text[start:end], replacement))
+                last = end
+        if last < len(text) or not segments:
+            segments.append((text[last:], None))
+        return segments
+
+
+    def replace(self, text):
+        """Replace all dictionary names within the text."""
+        return ''.join(x if r is None else r for x, r in self.segments(text))
+
+
+def read_dictionary_file(path):
+    """Read a dictionary file to dict of original -> replacement."""
+    entries = {}
+    with open(path, 'rt', encoding='utf-8-sig') as fobj:
+        for line in fobj:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            if '\t' not in line:
+                print(f'WARNING: Invalid line in dictionary \'{path}\': {line}')
+                continue
+            original, replacement = line.split('\t', 1)
+            entries[original.strip()] = replacement.strip()
+    return entries
+
+
+def load_dictionary(paths, cache_path=None):
+    """Load dictionary files to a NameDictionary. Later files override the earlier ones, missing
+    files are skipped. The compiled automaton is cached and rebuilt only if any of the files
+    has changed.
+
+    Args:
+    paths: Paths to the dictionary files.
+    cache_path: Path to the cache file, defaults to DEFAULT_CACHE_PATH.
+    """
+
+    if cache_path is None:
+        cache_path = DEFAULT_CACHE_PATH
+
+    # cache key identifies the versions of all dictionary files (lists, as they come from JSON)
+    key = [CACHE_VERSION]
+    for path in paths:
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            key.append([os.path.abspath(path), stat.st_mtime_ns, stat.st_size])
+
+    try:
+        with open(cache_path, 'rt', encoding='utf-8') as fobj:
+            cache = json.load(fobj)
+        if cache['key'] == key:
+            return NameDictionary.from_state(cache['dictionary'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    entries = {}
+    for path in paths:
+        if os.path.isfile(path):
+            entries.update(read_dictionary_file(path))
+    dictionary = NameDictionary(entries)
+
+    # written under a temporary name, so concurrent loads never see a partial file
+    try:
+        temp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wt', encoding='utf-8') as fobj:
+            json.dump({'key': key, 'dictionary': dictionary.to_state()}, fobj,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+    return dictionary
@@ -0,0 +1,184 @@
+"""
+Local server running requests of a script in a long-lived process, over a Unix socket.
+
+Expensive state (romanization engines, caches) is loaded once by the server and every request
+is handled by its own thread. Requests and responses are single lines of JSON. Output printed
+while handling a request is captured per thread and sent back in the response:
+
+  request:  {"path": "/music/album", "action": "export", "options": ["pinyin"]}
+  response: {"output": "...", "status": 0}
+
+This module uses only the standard library, so clients start as fast as the interpreter does.
+"""
+
+import getpass
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import traceback
+
+
+def default_socket_path(name):
+    """Return default path of the socket of a server, eg. /tmp/process_id3-user.sock."""
+    return os.path.join(tempfile.gettempdir(), f'{name}-{getpass.getuser()}.sock')
+
+
+class NoServerError(Exception):
+    """Raised by the client when no server is running on the socket."""
+
+
+class ThreadOutput(io.TextIOBase):
+    """Replacement of sys.stdout, which captures output of the threads handling requests and
+    passes output of the other threads to the original stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+
+    def capture(self):
+        """Start capturing output of the current thread."""
+        self.local.buffer = io.StringIO()
+
+
+    def release(self):
+        """Stop capturing output of the current thread and return the captured text."""
+        text = self.local.buffer.getvalue()
+        self.local.buffer = None
+        return text
+
+
+    def bind(self, function):
+        """Wrap the function, so that it prints to the output captured for the current thread
+        when it is called from other threads, eg. from workers of ThreadPoolExecutor."""
+        buffer = getattr(self.local, 'buffer', None)
+
+        def wrapper(*args, **kwargs):
+            previous = getattr(self.local, 'buffer', None)
+            self.local.buffer = buffer
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.buffer = previous
+
+        return wrapper
+
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+
+    def flush(self):
+        self.stream.flush()
+
+
+def read_message(rfile):
+    """Read a JSON message from the stream, None at end of the stream."""
+    line = rfile.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def write_message(wfile, message):
+    """Write a JSON message to the stream."""
+    wfile.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+    wfile.flush()
+
+
+def serve(socket_path, handle):
+    """Run the server until a stop request comes.
+
+    Args:
+    socket_path: Path to the Unix socket.
+    handle: Function handling a request, it gets the request as dict and returns exit status.
+        Its output is sent back to the client.
+    """
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print('ERROR: Unix sockets are not supported on this platform.')
+        return
+
+    # remove socket left over by a crashed server, but never steal one of a running server
+    if os.path.exists(socket_path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(socket_path)
+            print(f'ERROR: Server is already running on \'{socket_path}\'.')
+            return
+        except OSError:
+            os.unlink(socket_path)
+
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = read_message(self.rfile)
+            if request is None:
+                return
+            if request.get('stop'):
+                write_message(self.wfile, {'output': 'Server stopped.\n', 'status': 0})
+                self.server.shutdown()
+                return
+
+            output.capture()
+            try:
+                status = handle(request)
+            except Exception:
+                traceback.print_exc(file=output)
+                status = 1
+            finally:
+                text = output.release()
+            write_message(self.wfile, {'output': text, 'status': status})
+
+    with socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler) as server:
+        server.daemon_threads = True
+        print(f'Listening on \'{socket_path}\'.')
+        try:
+            server.serve_forever()
+        finally:
+            sys.stdout = output.stream
+            os.unlink(socket_path)
+
+
+def bind_output(function):
+    """Wrap the function to be run by other threads, so that its output is captured for the
+    request handled by the current thread. Outside of the server the function is returned as is.
+    """
+    if isinstance(sys.stdout, ThreadOutput):
+        return sys.stdout.bind(function)
+    return function
+
+
+def send_request(socket_path, request):
+    """Send the request to the server and wait for the response.
+
+    Returns:
+    Tuple (output, status).
+
+    Raises:
+    NoServerError: No server is running on the socket, the request hasn't been sent.
+    OSError: Communication with the server failed after the request might have been sent.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        raise NoServerError('Unix sockets are not supported on this platform')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError as e:
+            raise NoServerError(str(e)) from e
+        with sock.makefile('rwb') as stream:
+            write_message(stream, request)
+            response = read_message(stream)
+    if response is None:
+        return ('ERROR: Server closed the connection.\n', 1)
+    return (response['output'], response['status'])
@@ -0,0 +1,78 @@
+"""
+Generator of synthetic MP3 files with ID3 tags, for benchmarks.
+
+The files contain only a few silent MPEG frames, so even large libraries take little space.
+"""
+
+import os
+import random
+
+from . import id3v2
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no CRC, no padding
+MPEG_FRAME_HEADER = b'\xff\xfb\x90\x00'
+MPEG_FRAME_SIZE = 417
+
+LATIN_WORDS = ['love', 'night', 'rain', 'city', 'dream', 'heart', 'summer', 'blue', 'road', 'star']
+CJK_WORDS = ['愛', '夜', '雨', '城市', '夢', '心', '夏', '藍', '路', '星', '恋', '東京', '月']
+ARTISTS = ['Teresa Teng', 'Anita Mui', '鄧麗君', '梅艷芳', '中島みゆき']
+
+
+def silent_audio(frame_count=10):
+    """Return MPEG audio data with the given number of silent frames."""
+    return (MPEG_FRAME_HEADER + bytes(MPEG_FRAME_SIZE - len(MPEG_FRAME_HEADER))) * frame_count
+
+
+def create_mp3(path, tag=b'', frame_count=10):
+    """Create a MP3 file with the given serialized ID3 tag and silent audio."""
+    with open(path, 'wb') as fobj:
+        fobj.write(tag)
+        fobj.write(silent_audio(frame_count))
+
+
+def random_title(rnd, cjk_ratio=0.0):
+    """Return a random title, in Chinese/Japanese with probability 'cjk_ratio'."""
+    if rnd.random() < cjk_ratio:
+        return ''.join(rnd.sample(CJK_WORDS, rnd.randint(1, 4)))
+    return ' '.join(rnd.sample(LATIN_WORDS, rnd.randint(1, 4))).capitalize()
+
+
+def create_album(album_dir, track_count, cover_size=0, cjk_ratio=0.0, seed=0):
+    """Create a folder with a synthetic album.
+
+    Args:
+    album_dir: Folder of the album, it is created if it doesn't exist.
+    track_count: Number of tracks.
+    cover_size: Size of the front cover embedded to every track, in bytes. 0 for no cover.
+    cjk_ratio: Ratio of titles in Chinese/Japanese.
+    seed: Seed of the random generator, the same seed gives the same album.
+
+    Returns:
+    List of paths to the created MP3 files.
+    """
+
+    rnd = random.Random(seed)
+    os.makedirs(album_dir, exist_ok=True)
+
+    artist = rnd.choice(ARTISTS)
+    album_frames = b''.join([
+        id3v2.text_frame('TPE2', artist),
+        id3v2.text_frame('TALB', random_title(rnd, cjk_ratio)),
+        id3v2.text_frame('TDRC', str(rnd.randint(1970, 2020))),
+    ])
+    if cover_size > 0:
+        album_frames += id3v2.apic_frame(b'\xff\xd8' + rnd.randbytes(cover_size - 2))
+
+    paths = []
+    for i in range(track_count):
+        path = os.path.join(album_dir, f'{i + 1:03d}.mp3')
+        tag = id3v2.tag(
+            id3v2.text_frame('TRCK', f'{i + 1:02d}'),
+            id3v2.text_frame('TIT2', random_title(rnd, cjk_ratio)),
+            id3v2.text_frame('TPE1', artist),
+            album_frames,
+        )
+        create_mp3(path, tag)
+        paths.append(path)
+
+    return paths
@@ -1,12 +1,72 @@
-import os
+"""
+id3tool.py: imports ID3 tags of MP3 files from their filenames.
+
+Usage:
+id3tool.py [-n] [-j workers] [-p template]... [root_dir]
+
+  -n        Dry run, only print differences between the tags and the filenames.
+  -j        Number of worker threads.
+  -p        Filename template, eg. '{track} {artist} - {title}'. Can be given more times,
+            the first matching template is used. Supported fields: track, artist, title,
+            album, year. Defaults to '{track} {title}'.
+  root_dir  Root of the directory tree with MP3 files, defaults to current folder.
+"""
+
+import getopt
+import re
+import sys
 
 import id3lib.id3 as id3
 
 
 def main():
-    mp3_files = [f for f in os.listdir('.') if f.endswith('.mp3')]
-    for mp3_file in mp3_files:
-        id3.import_id3_from_filename(mp3_file)
+    dry_run = False
+    max_workers = None
+    templates = []
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hnj:p:')
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(__doc__)
+            sys.exit()
+        elif opt == '-n':
+            dry_run = True
+        elif opt == '-j':
+            max_workers = int(arg)
+        elif opt == '-p':
+            templates.append(arg)
+
+    root_dir = args[0] if len(args) > 0 else '.'
+    templates = templates or id3.DEFAULT_TEMPLATES
+
+    # check the templates before any file is touched, eg. unknown or repeated fields
+    for template in templates:
+        try:
+            id3.compile_template(template)
+        except (ValueError, re.error) as e:
+            print(f'ERROR: Invalid template \'{template}\': {e}')
+            sys.exit(2)
+
+    counts = {'changed': 0, 'unchanged': 0, 'unparsed': 0}
+    for mp3_path, changes in id3.import_from_filenames(root_dir, templates, dry_run, max_workers):
+        if changes is None:
+            counts['unparsed'] += 1
+            print(f'{mp3_path}: could not parse filename')
+        elif changes:
+            counts['changed'] += 1
+            for frame_id, (old, new) in changes.items():
+                print(f'{mp3_path}: {frame_id} {old!r} -> {new!r}')
+        else:
+            counts['unchanged'] += 1
+
+    verb = 'would be changed' if dry_run else 'changed'
+    print(f'{counts["changed"]} file(s) {verb}, {counts["unchanged"]} already matching,'
+          f' {counts["unparsed"]} not parsed.')
 
 
 if __name__ == "__main__":
@@ -3,23 +3,39 @@ process_id3.py: performs stuff with ID3 tags of MP3 files.
 
 Usage: 
 process_id3.py action [options]
+process_id3.py serve [socket_path]
 
 Arguments:
 action   Action to be performed. Supported values:
          - export: export ID3 tags to a XML file
          - import: import ID3 tags from a XML file
          - rename: rename the files per their ID3 tags
+         - playlist: create playlist for Winamp
+         - check: run regression checks of romanization of strings mixing dictionary names
+           with other text
+         Actions import, rename and playlist can be combined with '+', eg. 'import+rename', then
+         they are done in a single pass through the tracks.
 options  Options for the action. Supported values:
          - pinyin: convert chinese track titles to pinyin before export
+         - jyutping: convert chinese track titles to jyutping before export
+         - romaji: convert japanese track titles to romaji before export
+         - auto: detect language of every string and convert it with the right engine
+           (chinese to pinyin, or jyutping if given too; japanese to romaji). Without it,
+           the given engine converts all strings with Asian characters, if more engines are
+           given, pinyin is used before jyutping and jyutping before romaji.
          - album: treat the files as an album with a single artist
          - compilation: treat the files as an compilation with multiple artists
+serve    Instead of an action, run server in this process, which keeps the romanization engines
+         and tags of the tracks loaded and performs actions sent by process_id3_client.py.
+         Optional argument is path to the Unix socket.
+--profile[=path]
+         Print time spent in every stage and track. If a path is given, cProfile statistics
+         (*.prof) or Chrome trace (*.json) are written to it.
 """
 
 # TODO Add support for choice between album and compilation.
 # TODO Add restriction for transcription only if the whole string is in that language.
-# TODO Add auto detection of language.
 # TODO Create classes for actions and options to automate their listing in help.
-# TODO Group some actions so they can be done at once.
 # TODO Fix crash for missing ID3 tags.
 # TODO Add actions which skip the XML file and are done purely on ID3 tags.
 
@@ -30,39 +46,51 @@ options  Options for the action. Supported values:
 import os
 import re
 import sys
+import tempfile
+import threading
+import uuid
 import xml.etree.cElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Flag
 
 # 3rd party libraries
 from pinyin_jyutping import PinyinJyutping
 from pykakasi import kakasi
 from mutagen.id3 import Encoding, PictureType, ID3, APIC, TALB, TDRC, TIT2, TPE1, TPE2, TRCK
+from mutagen.id3 import ID3NoHeaderError
 from mutagen.mp3 import MP3
 import pathvalidate
 
+# local libraries
+from id3lib import id3v2, profiling, server
+from id3lib.profiling import profiler
+from id3lib.romanization import detect_language, load_dictionary
+from id3lib.romanization import LANGUAGE_CHINESE, LANGUAGE_JAPANESE
+
 #---------------------------------------------------------------------------------------------------
 # Constants
 #---------------------------------------------------------------------------------------------------
 
-# TODO Put this to an external file
-ROMANIZATION_DICT = {
-    '鳳飛飛': 'Fong Fei-Fei',
-    '汪明荃': 'Liza Wang',
-    '蔡國權': 'Terence Choi',
-    '陳百強': 'Danny Chan',
-    '譚詠麟': 'Alan Tam',
-    '鄭少秋': 'Adam Cheng',
-    '許冠傑': 'Sam Hui',
-    '徐小鳳': 'Paula Tsui',
-    '葉倩文': 'Sally Yeh',
-    '關淑怡': 'Shirley Kwan',
-    '黃寶欣': 'Sarah Wong',
-    '蔡楓華': 'Ken Choi',
-    '呂方': 'David Lui',
-    '梅艷芳': 'Anita Mui',
-    '黃耀明': 'Anthony Wong',
-    '張德蘭': 'Teresa Cheung',
-}
+# dictionaries of names which are used instead of automatic romanization, later files override
+# the earlier ones
+ROMANIZATION_DICT_PATHS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'romanization_dict.txt'),
+    os.path.join(os.path.expanduser('~'), '.romanization_dict.txt'),
+]
+
+# regression checks of romanization: (text, options, expected romanization)
+ROMANIZATION_CHECKS = [
+    ('梅艷芳與張國榮', 'jyutping', 'Anita Mui jyu zoenggwokwing'),
+    ('夢 梅艷芳', 'jyutping', 'Mung Anita Mui'),
+    ('張國榮 & 梅艷芳', 'jyutping', 'Zoenggwokwing & Anita Mui'),
+]
+
+# cache of text tags of the tracks, enabled in server mode
+tag_cache = None
+
+# maximal number of tracks in the cache, the least recently used ones are dropped
+TAG_CACHE_SIZE = 50000
 
 #---------------------------------------------------------------------------------------------------
 # Classes
@@ -92,6 +120,9 @@ class Options(Flag):
     ROMAJI = 0x04
     """Adds romaji for track and album titles in Japanese."""
 
+    AUTO = 0x08
+    """Detects language of every title and adds romanization by the right engine."""
+
     ALBUM = 0x10
     """Treats the album as album with one common artist."""
 
@@ -104,20 +135,93 @@ class Options(Flag):
     KEEP_ENGLISH = 0x80
     """Keeps English translation of Asian title, result will be E (A) [R]."""
 
+class TagCache:
+    """Cache of text tags of MP3 files, used by the server. An entry is valid as long as
+    modification time and size of the file don't change. Entries of renamed and rewritten
+    files are dropped and the cache is limited to the most recently used 'max_size' files,
+    so memory of a long-running server doesn't grow with every job."""
+
+    def __init__(self, max_size=TAG_CACHE_SIZE):
+        self.entries = OrderedDict()
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+
+    def read(self, path):
+        """Read text tags of the file, see id3v2.read_text_frames()."""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                profiler.count('tag_cache_hits')
+                return entry[1]
+
+        tags = id3v2.read_text_frames(path)
+        with self.lock:
+            self.entries[key] = (version, tags)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return tags
+
+
+    def discard(self, path):
+        """Drop the entry of the file, eg. after it has been renamed or rewritten."""
+        with self.lock:
+            self.entries.pop(os.path.abspath(path), None)
+
+
 class TrackInfo:
-    """Encapsulates ID3 tags of a MP3 file and provides methods to work with them."""
+    """Encapsulates ID3 tags of a MP3 file and provides methods to work with them.
 
-    pj = None
+    The text tags are read by the lean reader of id3lib and the strings are interned, as they
+    repeat a lot across the tracks. The mutagen ID3 object is created only when the tags are
+    going to be modified.
+    """
+
+    __slots__ = ('path', 'track_number', 'title', 'artist', 'album', 'year', 'album_artist',
+                 'length', '_tags')
 
     def __init__(self, path):
         self.path = path
-        self.tags = ID3(path)
-        self.track_number = self.__get_tag('TRCK')
-        self.title = self.__get_tag('TIT2')
-        self.artist = self.__get_tag('TPE1')
-        self.album = self.__get_tag('TALB')
-        self.year = str(self.__get_tag('TDRC'))
-        self.album_artist = self.__get_tag('TPE2')
+        self.length = None
+        self._tags = None
+        with profiler.stage('read_tags', path):
+            if tag_cache is not None:
+                tags = tag_cache.read(path)
+            else:
+                tags = id3v2.read_text_frames(path)
+        self.track_number = tags.get('TRCK')
+        self.title = tags.get('TIT2')
+        self.artist = intern(tags.get('TPE1'))
+        self.album = intern(tags.get('TALB'))
+        self.year = intern(str(tags.get('TDRC')))
+        self.album_artist = intern(tags.get('TPE2'))
+
+
+    @property
+    def tags(self):
+        """The mutagen ID3 object, it is created on the first access."""
+        if self._tags is None:
+            try:
+                self._tags = ID3(self.path)
+            except ID3NoHeaderError:
+                self._tags = ID3()
+        return self._tags
+
+
+    def load(self):
+        """Load the MP3 file by mutagen, to get both the ID3 tags for modification and the length
+        of the track from a single parsing of the file."""
+        with profiler.stage('mutagen_load', self.path):
+            audio = MP3(self.path)
+        if audio.tags is None:
+            audio.add_tags()
+        self._tags = audio.tags
+        self.length = int(audio.info.length)
 
 
     def create_xml_element(self, album_element, export_artist=False, export_year=False):
@@ -151,19 +255,24 @@ class TrackInfo:
         self.title = element.attrib.get('title')
 
 
-    def import_front_cover(self, path):
+    def import_front_cover(self, path, pict_data=None):
         """Imports front cover from a JPG file and stores it to ID3 tag.
 
         Args:
         path: Path to the JPG file.
+        pict_data: Content of the JPG file, if it has been already read.
         """
 
-        with open(path, 'rb') as fobj:
-            pict_data = fobj.read()
+        if pict_data is None:
+            with profiler.stage('cover_read', self.path):
+                with open(path, 'rb') as fobj:
+                    pict_data = fobj.read()
+            profiler.count('bytes_read', len(pict_data))
 
-        pict = APIC(mime='image/jpeg', type=PictureType.COVER_FRONT, data=pict_data)
-        self.tags.delall('APIC')
-        self.tags.add(pict)
+        with profiler.stage('cover_embed', self.path):
+            pict = APIC(mime='image/jpeg', type=PictureType.COVER_FRONT, data=pict_data)
+            self.tags.delall('APIC')
+            self.tags.add(pict)
 
 
     def save(self):
@@ -174,31 +283,50 @@ class TrackInfo:
         self.__set_tag('TPE2', self.album_artist)
         self.__set_tag('TALB', self.album)
         self.__set_tag('TDRC', self.year)
-        self.tags.save(v2_version=4)
+        size_before = os.path.getsize(self.path)
+        with profiler.stage('save', self.path):
+            self.tags.save(self.path, v2_version=4)
+        profiler.count('files_written')
+
+        # mutagen writes the tag in place, unless its size changes and the audio is moved too
+        size_after = os.path.getsize(self.path)
+        if size_after != size_before:
+            profiler.count('bytes_written', size_after)
+        else:
+            with open(self.path, 'rb') as fobj:
+                profiler.count('bytes_written', id3v2.read_header(fobj)[2])
+        if tag_cache is not None:
+            tag_cache.discard(self.path)
 
 
-    def rename(self, options):
-        """Rename the MP3 file per info in its ID3 tags.
+    def get_new_path(self, options):
+        """Return path of the MP3 file named per info in its ID3 tags, None if the options
+        don't define any name.
         
         Args:
         options: Options for the operation.
         """
-        new_path = None
+        new_name = None
         if options & Options.ALBUM:
-            new_path = f'{self.track_number} {self.title}.mp3'
+            new_name = f'{self.track_number} {self.title}.mp3'
         elif options & Options.COMPILATION:
-            new_path = f'{self.track_number} {self.artist} - {self.title}.mp3'
-        
-        if new_path is not None:
-            os.rename(self.path, new_path)
+            new_name = f'{self.track_number} {self.artist} - {self.title}.mp3'
+        if new_name is None:
+            return None
+        return os.path.join(os.path.dirname(self.path), new_name)
 
 
-    def __get_tag(self, tag_id):
-        tag = None
-        if tag_id in self.tags:
-            tag = self.tags[tag_id].text[0]
+    def load_length(self):
+        """Read length of the track, unless it is already known."""
+        if self.length is None:
+            with profiler.stage('mp3_length', self.path):
+                self.length = int(MP3(self.path).info.length)
 
-        return tag
+
+    def get_playlist_entry(self):
+        """Return entry of the track for M3U playlist."""
+        self.load_length()
+        return f'#EXTINF:{self.length},{self.artist} - {self.title}\n{os.path.basename(self.path)}\n'
 
 
     def __set_tag(self, tag_id, value):
@@ -222,6 +350,10 @@ class AlbumInfo:
 
     pj = None
     kks = None
+    names = None
+
+    # guards the engines shared by all instances, which may run in concurrent threads
+    engines_lock = threading.Lock()
 
     def __init__(self, path='.', options=Options.NONE):
         self.path = path
@@ -232,11 +364,48 @@ class AlbumInfo:
 
         self.track_list = []
         for mp3_filename in mp3_list:
-            self.track_list.append(TrackInfo(mp3_filename))
+            self.track_list.append(TrackInfo(os.path.join(path, mp3_filename)))
 
         self.__check_same_tags()
 
 
+    @staticmethod
+    def load_engines():
+        """Load the romanization engines and the dictionary of names in advance."""
+        with AlbumInfo.engines_lock:
+            if AlbumInfo.pj is None:
+                AlbumInfo.pj = PinyinJyutping()
+            if AlbumInfo.kks is None:
+                AlbumInfo.kks = kakasi()
+            # the first conversions load the word segmentation models
+            AlbumInfo.pj.pinyin('中文')
+            AlbumInfo.kks.convert('日本語')
+            if AlbumInfo.names is None:
+                AlbumInfo.names = load_dictionary(ROMANIZATION_DICT_PATHS)
+
+
+    @staticmethod
+    def check_romanization():
+        """Romanize strings of ROMANIZATION_CHECKS and report those which don't match.
+
+        Returns:
+        True if all the checks have passed.
+        """
+        AlbumInfo.load_engines()
+        failed = 0
+        with tempfile.TemporaryDirectory() as empty_dir:
+            for text, options, expected in ROMANIZATION_CHECKS:
+                album_info = AlbumInfo(empty_dir, parse_options(options.split()))
+                romanization = album_info.__add_romanization(text, preserve_original=False)
+                if romanization != expected:
+                    print(f'ERROR: \'{text}\' romanized as \'{romanization}\','
+                          f' expected \'{expected}\'')
+                    failed += 1
+        print(f'{len(ROMANIZATION_CHECKS) - failed}/{len(ROMANIZATION_CHECKS)} romanization'
+              ' checks passed.')
+        return failed == 0
+
+
     def export_to_xml(self):
         """Export album information to a XML file.
         
@@ -247,66 +416,211 @@ class AlbumInfo:
         self.__build_album_attrib()
         album_element = ET.Element('album', attrib=self.album_attrib)
         for track_info in self.track_list:
-            track_info.title = self.__add_romanization(track_info.title)
-            if (self.options & Options.SWAP_TRANSCRIPTION_POSITION):
-                track_info.title = self.__swap_romanization(track_info.title)
-            track_info.artist = self.__add_romanization(track_info.artist, preserve_original=False, lookup=True)
+            with profiler.stage('romanization', track_info.path):
+                track_info.title = self.__add_romanization(track_info.title)
+                if (self.options & Options.SWAP_TRANSCRIPTION_POSITION):
+                    track_info.title = self.__swap_romanization(track_info.title)
+                track_info.artist = self.__add_romanization(track_info.artist, preserve_original=False, lookup=True)
             track_info.create_xml_element(album_element, 
                                           export_artist = not self.same_artist, 
                                           export_year = not self.same_year)
 
-        tree = ET.ElementTree(album_element)
-        ET.indent(tree)
-        tree.write('album.xml', encoding='utf-8', xml_declaration=True)
+        xml_path = os.path.join(self.path, 'album.xml')
+        with profiler.stage('xml_write'):
+            tree = ET.ElementTree(album_element)
+            ET.indent(tree)
+            tree.write(xml_path, encoding='utf-8', xml_declaration=True)
+        profiler.count('bytes_written', os.path.getsize(xml_path))
         print('ID3 tags have been exported to file album.xml.')
 
 
     def import_from_xml(self):
         """Import data from a XML file and store to the ID3 tags of the MP3 files."""
+        return self.run_pipeline(['import'])
+
+
+    def rename_files(self):
+        """Renames the MP3 files per their ID3 tags."""
+        return self.run_pipeline(['rename'])
+
+
+    def create_playlist(self):
+        """Create playlist for Winamp."""
+        return self.run_pipeline(['playlist'])
+
+
+    def run_pipeline(self, actions, max_workers=None):
+        """Perform the actions in a single pass through the tracks. Every track is loaded once,
+        its tags are written once, it is renamed once and its playlist entry is built from the
+        data already in memory. Tracks are loaded and written concurrently, then they are renamed
+        sequentially, so the result doesn't depend on order of the threads.
+
+        Args:
+        actions: List of actions, supported are 'import', 'rename' and 'playlist'.
+        max_workers: Number of worker threads, defaults to ThreadPoolExecutor's default.
+
+        Returns:
+        True if the actions have been performed, False if they are not supported, the XML file
+        doesn't match the MP3 files or renaming has failed.
+        """
+
+        unsupported = set(actions) - {'import', 'rename', 'playlist'}
+        if unsupported:
+            print(f'ERROR: Actions not supported in pipeline: {", ".join(sorted(unsupported))}')
+            return False
+
+        if 'import' in actions and not self.__load_xml():
+            return False
+
+        if self.options & (Options.ALBUM | Options.COMPILATION):
+            # renaming option has been given in an argument            
+            rename_options = self.options
+        else:
+            # renaming option to be derived from track parameters
+            if self.same_artist:
+                rename_options = Options.ALBUM
+            else:
+                rename_options = Options.COMPILATION
+
+        def process_track(index):
+            trk = self.track_list[index]
+            if 'import' in actions:
+                trk.load()
+                self.__import_track_element(index)
+            if 'playlist' in actions:
+                trk.load_length()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # output of the workers belongs to the request in server mode
+            list(executor.map(server.bind_output(process_track), range(len(self.track_list))))
+
+        if 'import' in actions:
+            print('ID3 tags have been imported from file album.xml.')
+        if 'rename' in actions and not self.__rename_tracks(rename_options):
+            return False
+        if 'playlist' in actions:
+            self.__write_playlist([trk.get_playlist_entry() for trk in self.track_list])
+        return True
+
+
+    def __rename_tracks(self, options):
+        """Rename the MP3 files per their ID3 tags, in order of their current paths. Tracks whose
+        new name is taken by a file which isn't renamed (or by an earlier track) are left as they
+        are. If a new name is a current name of another renamed track, all tracks are renamed
+        through temporary names, like rename_files.py does. Names are compared case-insensitively
+        on the file systems which are, so eg. '01 love.mp3' can be renamed to '01 Love.mp3'.
+        If a rename fails, the tracks renamed so far are moved back to their original names.
+
+        Args:
+        options: Options for the renaming.
+
+        Returns:
+        True if all the renames have been performed.
+        """
+
+        renames = {}
+        for trk in sorted(self.track_list, key=lambda x: x.path):
+            new_path = trk.get_new_path(options)
+            if new_path is not None and new_path != trk.path:
+                renames[trk] = new_path
+
+        # drop renames to names which are taken, until the rest doesn't collide
+        while True:
+            sources = {os.path.normcase(trk.path) for trk in renames}
+            targets = set()
+            for trk, new_path in renames.items():
+                target = os.path.normcase(new_path)
+                # existing file may be the track itself, when only case of its name changes
+                taken = os.path.exists(new_path) and target not in sources and \
+                    not os.path.samefile(new_path, trk.path)
+                if target in targets or taken:
+                    print(f'ERROR: Cannot rename \'{trk.path}\','
+                          f' file \'{new_path}\' already exists')
+                    del renames[trk]
+                    break
+                targets.add(target)
+            else:
+                break
+
+        moved = []  # (track, its path before the rename), in order of the renames
+
+        def move(trk, path):
+            os.rename(trk.path, path)
+            if tag_cache is not None:
+                tag_cache.discard(trk.path)
+            moved.append((trk, trk.path))
+            trk.path = path
+
+        try:
+            with profiler.stage('rename'):
+                if not targets.isdisjoint(sources):
+                    token = uuid.uuid4().hex
+                    for trk in renames:
+                        move(trk, f'{trk.path}.{token}.tmp')
+                for trk, new_path in renames.items():
+                    move(trk, new_path)
+        except OSError as e:
+            for trk, path in reversed(moved):
+                os.rename(trk.path, path)
+                trk.path = path
+            print(f'ERROR: Renaming failed, all files have got their original names back: {e}')
+            return False
+        return True
+
+
+    def __load_xml(self):
+        """Load the XML file and the cover image for import.
+
+        Returns:
+        True if the XML file matches the MP3 files.
+        """
 
         # load the XML file
-        tree = ET.parse('album.xml')
+        xml_path = os.path.join(self.path, 'album.xml')
+        with profiler.stage('xml_read'):
+            tree = ET.parse(xml_path)
+        profiler.count('bytes_read', os.path.getsize(xml_path))
         self.album_element = tree.getroot()
 
         # get cover image (if there is exactly one JPG file in the folder)
-        files = os.listdir()
+        files = os.listdir(self.path)
         jpg_files = [f for f in files if f.endswith('.jpg')]
         if len(jpg_files) == 1:
-            self.cover_path = jpg_files[0]
+            self.cover_path = os.path.join(self.path, jpg_files[0])
         else:
             self.cover_path = None
 
+        # read the cover image once, it is shared by all tracks
+        cover_path = self.album_element.attrib.get('front_cover')
+        if cover_path is not None:
+            cover_path = os.path.join(self.path, cover_path)
+        else:
+            cover_path = self.cover_path
+        if cover_path is not None:
+            with profiler.stage('cover_read'):
+                with open(cover_path, 'rb') as fobj:
+                    self.cover_data = fobj.read()
+            profiler.count('bytes_read', len(self.cover_data))
+        else:
+            self.cover_data = None
+
         number_of_elements = len(self.album_element)
         number_of_files = len(self.track_list)
 
-        if number_of_elements == number_of_files:
-            for i in range(number_of_elements):
-                self.__import_track_element(i)
-            print('ID3 tags have been imported from file album.xml.')
-        else:
+        if number_of_elements != number_of_files:
             print(f'ERROR: Count mismatch, there are {number_of_files} MP3 files and' + 
                   f' {number_of_elements} tracks in the XML file.')
+            return False
 
+        return True
 
-    def rename_files(self):
-        """Renames the MP3 files per their ID3 tags."""
-
-        if self.options & (Options.ALBUM | Options.COMPILATION):
-            # renaming option has been given in an argument            
-            options = self.options
-        else:
-            # renaming option to be derived from track parameters
-            if self.same_artist:
-                options = Options.ALBUM
-            else:
-                options = Options.COMPILATION
-        
-        for track_info in self.track_list:
-            track_info.rename(options)
 
+    def __write_playlist(self, entries):
+        """Write playlist for Winamp.
 
-    def create_playlist(self):
-        """Create playlist for Winamp."""
+        Args:
+        entries: Playlist entries of the tracks.
+        """
         
         trk0 = self.track_list[0]
         if self.same_artist is not None:
@@ -319,16 +633,13 @@ class AlbumInfo:
             year = ''
 
         filename = f'!{artist}{trk0.album}{year}.m3u8'
-        filename = pathvalidate.sanitize_filename(filename)
-
-        with open(filename, 'wt', encoding='utf_8_sig') as fobj:
-            fobj.write('#EXTM3U\n')
-            for track in self.track_list:
-                audio = MP3(track.path)
-                length = int(audio.info.length)
-                title = f'{track.artist} - {track.title}'                
-                fobj.write(f'#EXTINF:{length},{title}\n')
-                fobj.write(f'{track.path}\n')
+        filename = os.path.join(self.path, pathvalidate.sanitize_filename(filename))
+
+        with profiler.stage('playlist_write'):
+            with open(filename, 'wt', encoding='utf_8_sig') as fobj:
+                fobj.write('#EXTM3U\n')
+                fobj.writelines(entries)
+        profiler.count('bytes_written', os.path.getsize(filename))
         
         print(f'Created playlist file \'{filename}\'.')
 
@@ -381,9 +692,9 @@ class AlbumInfo:
         if 'album_artist' in aat:
             trk.album_artist = aat['album_artist']
         if 'front_cover' in aat:
-            trk.import_front_cover(aat['front_cover'])
+            trk.import_front_cover(os.path.join(self.path, aat['front_cover']), self.cover_data)
         elif self.cover_path is not None:
-            trk.import_front_cover(self.cover_path)
+            trk.import_front_cover(self.cover_path, self.cover_data)
 
         # replace track artist with album artist, if needed
         if ((not 'artist' in tel.attrib) or (tel.attrib['artist'] is None)) and \
@@ -399,9 +710,7 @@ class AlbumInfo:
         trk.save()
 
 
-    def __add_romanization(self, text, preserve_original=True, lookup=False):
-
-        romanization = text
+    def __add_romanization(self, text, preserve_original=True, lookup=True):
 
         if preserve_original and self.options & Options.KEEP_ENGLISH:
             pattern = r"^(.*?)\s*\((.*?)\)$"
@@ -412,42 +721,115 @@ class AlbumInfo:
         else:
             asian = text
 
-        if lookup and (asian in ROMANIZATION_DICT):
-            romanization = ROMANIZATION_DICT[asian]
-        elif self.options & (Options.PINYIN | Options.JYUTPING):
+        # replace known names from the dictionary, romanize only the rest
+        if lookup:
+            with AlbumInfo.engines_lock:
+                if AlbumInfo.names is None:
+                    AlbumInfo.names = load_dictionary(ROMANIZATION_DICT_PATHS)
+            segments = AlbumInfo.names.segments(asian)
+        else:
+            segments = [(asian, None)]
 
-            # this instance is quite expensive, so we create it once and reuse it
-            if AlbumInfo.pj is None:
-                AlbumInfo.pj = PinyinJyutping()
+        parts = []
+        for segment, replacement in segments:
+            if replacement is not None:
+                parts.append(replacement)
+            else:
+                parts.append(self.__romanize(segment, capitalize=False))
+        if parts != [x for x, _ in segments]:
+            romanization = join_romanization(parts)
+        else:
+            romanization = asian
+
+        if preserve_original and (romanization != asian):
+            if self.options & Options.KEEP_ENGLISH:
+                romanization = f'{english} ({asian}) [{romanization}]'
+            else:
+                romanization = f'{asian} ({romanization})'
+
+        return romanization
+
+
+    def __select_engine(self, asian):
+        """Select romanization engine for the text per its language and the options.
+
+        Returns:
+        One of Options.PINYIN, Options.JYUTPING, Options.ROMAJI, or Options.NONE if the text
+        shouldn't be converted.
+        """
+
+        engines = self.options & (Options.PINYIN | Options.JYUTPING | Options.ROMAJI)
+        if not (engines or self.options & Options.AUTO):
+            return Options.NONE
+
+        # strings without any Asian characters never go to the engines
+        language = detect_language(asian)
+        if language is None:
+            return Options.NONE
+
+        # explicitly given engine converts every string, pinyin is preferred over jyutping
+        if not self.options & Options.AUTO:
+            if self.options & Options.PINYIN:
+                return Options.PINYIN
+            if self.options & Options.JYUTPING:
+                return Options.JYUTPING
+            return Options.ROMAJI
+
+        if language == LANGUAGE_JAPANESE:
+            return Options.ROMAJI
+        if language == LANGUAGE_CHINESE:
+            if self.options & Options.JYUTPING:
+                return Options.JYUTPING
+            if self.options & Options.PINYIN:
+                return Options.PINYIN
+            if self.options & Options.ROMAJI:
+                return Options.ROMAJI  # Japanese title written only in kanji
+            return Options.PINYIN
+        return Options.NONE
+
+
+    def __romanize(self, asian, capitalize=True):
+        """Romanize the text with the engine selected per its language and the options. If not
+        capitalized, the romanization is all in lower case.
+
+        Returns:
+        The romanization, or the text itself if it shouldn't be converted or the romanization
+        fails.
+        """
+
+        romanization = asian
+        engine = self.__select_engine(asian)
+
+        if engine & (Options.PINYIN | Options.JYUTPING):
 
             try:
-                if self.options & Options.PINYIN:
-                    romanization = AlbumInfo.pj.pinyin(asian, tone_numbers=True)
-                else:
-                    romanization = AlbumInfo.pj.jyutping(asian, tone_numbers=True)
+                with AlbumInfo.engines_lock:
+                    # this instance is quite expensive, so we create it once and reuse it
+                    if AlbumInfo.pj is None:
+                        AlbumInfo.pj = PinyinJyutping()
+                    if engine & Options.PINYIN:
+                        romanization = AlbumInfo.pj.pinyin(asian, tone_numbers=True)
+                    else:
+                        romanization = AlbumInfo.pj.jyutping(asian, tone_numbers=True)
                 romanization = [x for x in romanization if not x.isdigit()]
-                romanization = ''.join(romanization).capitalize()
+                romanization = ''.join(romanization)
+                romanization = romanization.capitalize() if capitalize else romanization.lower()
             except:
                 print(f'ERROR: Romanization failed for string \'{asian}\'')
         
-        elif self.options & Options.ROMAJI:
-
-            if AlbumInfo.kks is None:
-                AlbumInfo.kks = kakasi()
+        elif engine & Options.ROMAJI:
 
             try:
-                romanization = AlbumInfo.kks.convert(asian)                
+                with AlbumInfo.engines_lock:
+                    if AlbumInfo.kks is None:
+                        AlbumInfo.kks = kakasi()
+                    romanization = AlbumInfo.kks.convert(asian)
                 romanization = [x['hepburn'] for x in romanization]
-                romanization = ' '.join(romanization).capitalize()
+                romanization = ' '.join(romanization)
+                romanization = romanization.capitalize() if capitalize else romanization.lower()
             except:
                 print(f'ERROR: Romanization failed for string \'{asian}\'')
 
-        if preserve_original and (romanization != asian):
-            if self.options & Options.KEEP_ENGLISH:
-                romanization = f'{english} ({asian}) [{romanization}]'
-            else:
-                romanization = f'{asian} ({romanization})'
-
         return romanization
 
 
@@ -472,17 +854,18 @@ class AlbumInfo:
         """
 
         trl = self.track_list  # alias
+        if len(trl) == 0:
+            (self.same_artist, self.same_year) = (None, None)
+            return
 
+        # single pass through the tracks, stop as soon as both tags differ
         same_artist = True
         same_year = True
-        
-        track_count = len(trl)
-        if track_count > 1:
-            for i in range(1, track_count):
-                if not trl[0].artist == trl[i].artist:
-                    same_artist = False
-                if not trl[0].year == trl[i].year:
-                    same_year = False
+        for trk in trl:
+            same_artist = same_artist and (trk.artist == trl[0].artist)
+            same_year = same_year and (trk.year == trl[0].year)
+            if not (same_artist or same_year):
+                break
 
         if same_artist:
             if trl[0].artist is None:
@@ -505,45 +888,72 @@ class AlbumInfo:
 #---------------------------------------------------------------------------------------------------
 
 
+def join_romanization(parts):
+    """Join dictionary replacements and romanized parts of a string by single spaces (no space
+    before punctuation) and capitalize the first letter of the result, the rest is kept, so
+    the names from the dictionary keep their case.
+    """
+    text = ' '.join(x.strip() for x in parts if x.strip())
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ([,.;:!?)\]])', r'\1', text)
+    text = re.sub(r'([(\[]) ', r'\1', text)
+    return text[:1].upper() + text[1:]
+
+
+def intern(text):
+    """Intern the string, so the equal strings are stored only once. None is passed through."""
+    if text is None:
+        return None
+    return sys.intern(text)
+
+
 def debug():
     pass
 
 
-def main():
-    action = None
+def parse_options(args):
+    """Convert option arguments to Options, unknown ones are ignored."""
+    supported_options = {
+        'pinyin': Options.PINYIN,
+        'jyutping': Options.JYUTPING,
+        'romaji': Options.ROMAJI,
+        'auto': Options.AUTO,
+        'album': Options.ALBUM,
+        'compilation': Options.COMPILATION,
+        'swap': Options.SWAP_TRANSCRIPTION_POSITION,
+        'keepeng': Options.KEEP_ENGLISH,
+    }
+
     options = Options.NONE
+    for opt in args:
+        if opt in supported_options:
+            options = options | supported_options[opt]
+    return options
 
-    # first argument is action 
-    if len(sys.argv) > 1:
-        action = sys.argv[1]
-    
-    # the next arguments after action are options
-    if len(sys.argv) > 2:
-        supported_options = {
-            'pinyin': Options.PINYIN,
-            'jyutping': Options.JYUTPING,
-            'romaji': Options.ROMAJI,
-            'album': Options.ALBUM,
-            'compilation': Options.COMPILATION,
-            'swap': Options.SWAP_TRANSCRIPTION_POSITION,
-            'keepeng': Options.KEEP_ENGLISH,
-        }
 
-        for i in range(2, len(sys.argv)):
-            opt = sys.argv[i]
-            if opt in supported_options:
-                options = options | supported_options[opt]
+def run_action(path, action, options):
+    """Perform the action on the album in the folder.
 
-    album_info = AlbumInfo('.', options)
+    Args:
+    path: Folder of the album.
+    action: Action from the command line, None for the default one.
+    options: Options for the action.
+
+    Returns:
+    True if the action has been performed, False if it is not supported or has failed.
+    """
+
+    album_info = AlbumInfo(path, options)
 
     if action is None:
-        if not os.path.isfile('album.xml'):
+        if not os.path.isfile(os.path.join(path, 'album.xml')):
             album_info.export_to_xml()
         else:
             # TODO Request confirmation
-            album_info.import_from_xml()
-            album_info.rename_files()
-            album_info.create_playlist()
+            return album_info.run_pipeline(['import', 'rename', 'playlist'])
+    elif '+' in action:
+        aliases = {'i': 'import', 'r': 'rename', 'pl': 'playlist'}
+        return album_info.run_pipeline([aliases.get(x, x) for x in action.split('+')])
     else:
         supported_actions = {
             'export':   album_info.export_to_xml,
@@ -554,15 +964,67 @@ def main():
             'r':        album_info.rename_files,
             'playlist': album_info.create_playlist,
             'pl':       album_info.create_playlist,
+            'check':    AlbumInfo.check_romanization,
             'debug':    debug
         }
 
-        # perform the action
+        # perform the action, export returns nothing as it fails only by exceptions
         if action in supported_actions:
-            supported_actions[action]()
+            return supported_actions[action]() is not False
         else:
             print('ERROR: Action not supported')
             print(__doc__)
+            return False
+
+    return True
+
+
+def serve(socket_path=None):
+    """Run the server handling actions sent by process_id3_client.py. The romanization engines
+    are loaded once and text tags of the tracks are cached, until the files are modified.
+    Requests are handled concurrently, but only one at a time for the same album folder.
+    """
+    global tag_cache
+
+    if socket_path is None:
+        socket_path = server.default_socket_path('process_id3')
+
+    with profiler.stage('engines_load'):
+        AlbumInfo.load_engines()
+    tag_cache = TagCache()
+
+    album_locks = {}
+    album_locks_lock = threading.Lock()
+
+    def handle(request):
+        path = os.path.abspath(request['path'])
+        with album_locks_lock:
+            lock = album_locks.setdefault(path, threading.Lock())
+        with lock:
+            return 0 if run_action(path, request.get('action'),
+                                   parse_options(request.get('options', []))) else 1
+
+    server.serve(socket_path, handle)
+
+
+def main():
+    action = None
+
+    # profiling option can be anywhere in the arguments
+    sys.argv = profiling.parse_argv(sys.argv)
+
+    # first argument is action 
+    if len(sys.argv) > 1:
+        action = sys.argv[1]
+
+    if action == 'serve':
+        serve(sys.argv[2] if len(sys.argv) > 2 else None)
+        return
+
+    # the next arguments after action are options
+    options = parse_options(sys.argv[2:])
+    if not run_action('.', action, options):
+        sys.exit(1)
 
 
 #---------------------------------------------------------------------------------------------------
@@ -571,4 +1033,7 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        profiler.finish()
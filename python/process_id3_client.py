@@ -0,0 +1,74 @@
+"""
+process_id3_client.py: thin client of the process_id3.py server.
+
+Sends the action for the current folder to the server started by 'process_id3.py serve',
+prints its output and exits with its status, so the interpreter startup and loading of
+the romanization engines are paid just once by the server. If no server is running, the action
+is performed by process_id3.py directly. If the connection fails after the request has been sent,
+the action is not repeated, as the server may have performed it already.
+
+Usage:
+process_id3_client.py [-s socket_path] action [options]
+process_id3_client.py [-s socket_path] --stop
+
+  action, options  Same as for process_id3.py.
+  -s               Path to the Unix socket of the server, defaults to the one of
+                   'process_id3.py serve'.
+  --stop           Stop the server.
+"""
+
+import getopt
+import os
+import subprocess
+import sys
+
+from id3lib import server
+
+
+def main():
+    socket_path = server.default_socket_path('process_id3')
+    stop = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hs:', ['stop'])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(__doc__)
+            sys.exit()
+        elif opt == '-s':
+            socket_path = arg
+        elif opt == '--stop':
+            stop = True
+
+    if stop:
+        request = {'stop': True}
+    else:
+        request = {
+            'path': os.getcwd(),
+            'action': args[0] if len(args) > 0 else None,
+            'options': args[1:],
+        }
+
+    try:
+        (output, status) = server.send_request(socket_path, request)
+    except server.NoServerError:
+        if stop:
+            print('ERROR: Server is not running.')
+            sys.exit(1)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'process_id3.py')
+        sys.exit(subprocess.call([sys.executable, script] + args))
+    except OSError as e:
+        # the request may have been performed already, so it is not repeated locally
+        print(f'ERROR: Communication with the server failed: {e}')
+        sys.exit(1)
+
+    sys.stdout.write(output)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
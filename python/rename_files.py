@@ -1,29 +1,212 @@
 """
 Script of mass renaming of files, with support for UTF-8.
 
-TODO Add verification of command line arguments.
+Usage:
+rename_files.py [-n] [-j workers] pattern names.txt
+rename_files.py [-n] [-j workers] -t template pattern
+rename_files.py [-n] [-j workers] -r regex replacement pattern
+
+  pattern      Wildcard pattern of files to be renamed, eg. 'photos/*.jpg'. Files are sorted
+               naturally, ie. 'file2' goes before 'file10'.
+  names.txt    Text file with new names, one per line, in order of the sorted files.
+  -t template  Template of new names, with fields {n} (1-based index, eg. {n:03d}), {name},
+               {stem} and {ext}, eg. '{n:02d} {stem}{ext}'.
+  -r           Rename by regex substitution on the filename, eg. -r '^IMG_' 'Photo_'.
+  -n           Dry run, only print what would be renamed.
+  -j workers   Rename on a pool of worker threads.
+
+All new names are checked before any file is renamed. If counts don't match, some new name is
+duplicated or some file would be overwritten, nothing is renamed.
 """
 
-import glob
+import fnmatch
+import getopt
 import os
+import re
 import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def natural_key(name):
+    """Sort key ordering numbers in the name by their value, eg. 'file2' before 'file10'."""
+    return [(0, int(x), x) if x.isdigit() else (1, 0, x.lower())
+            for x in re.split(r'(\d+)', name) if x]
+
+
+def list_files(pattern):
+    """List files matching the wildcard pattern, sorted naturally."""
+    directory = os.path.dirname(pattern)
+    file_pattern = os.path.basename(pattern)
+    with os.scandir(directory or '.') as entries:
+        names = [x.name for x in entries if x.is_file() and fnmatch.fnmatch(x.name, file_pattern)]
+    names.sort(key=natural_key)
+    return [os.path.join(directory, x) for x in names]
+
+
+def names_from_file(path):
+    """Return name source streaming new names from a text file, one per line."""
+    def source(files):
+        with open(path, encoding='utf-8') as fobj:
+            for line in fobj:
+                yield line.rstrip('\r\n')
+    return source
+
+
+def names_from_template(template):
+    """Return name source building new names from a template."""
+    def source(files):
+        for n, path in enumerate(files, start=1):
+            name = os.path.basename(path)
+            (stem, ext) = os.path.splitext(name)
+            yield template.format(n=n, name=name, stem=stem, ext=ext)
+    return source
+
+
+def names_from_regex(regex, replacement):
+    """Return name source substituting the regex in the filenames."""
+    compiled = re.compile(regex)
+    def source(files):
+        for path in files:
+            yield compiled.sub(replacement, os.path.basename(path))
+    return source
+
+
+def iter_renames(files, source):
+    """Yield pairs (src, dst) of the files and new names from the name source. New names are
+    placed to the directory of the files. A missing name or file is yielded as None.
+    """
+    names = source(files)
+    for path in files:
+        name = next(names, None)
+        if name is None:
+            yield (path, None)
+        else:
+            yield (path, os.path.join(os.path.dirname(path), name))
+    for name in names:
+        yield (None, name)
+
+
+def check_renames(files, source):
+    """Check all renames before any file is renamed.
 
-# process input arguments
-input_pattern = sys.argv[1]
-input_source = sys.argv[2]
+    Returns:
+    List of error messages, empty if the renames are safe.
+    """
+    errors = []
+    sources = set(files)
+    targets = set()
+    missing_names = 0
+    extra_names = 0
+    for src, dst in iter_renames(files, source):
+        if dst is None:
+            missing_names += 1
+        elif src is None:
+            extra_names += 1
+        elif os.path.basename(dst) in ('', '.', '..'):
+            errors.append(f'Empty new name for {src}')
+        elif dst in targets:
+            errors.append(f'Duplicate new name {dst}')
+        elif os.path.exists(dst) and dst not in sources:
+            errors.append(f'File {dst} already exists')
+        else:
+            targets.add(dst)
 
-# get list of files matching the pattern
-files_list = glob.glob(input_pattern)
+    if missing_names or extra_names:
+        name_count = len(files) - missing_names + extra_names
+        errors.insert(0, f'Number of files ({len(files)}) and new names ({name_count}) don\'t match')
 
-# get list of new names from the source
-with open(input_source, encoding='utf-8') as fobj:
-    lines = [line.rstrip() for line in fobj]
+    return errors
 
-# if the lists have same length, rename the files
-if len(files_list) == len(lines):
-    for src, dst in zip(files_list, lines):
+
+def rename_files(files, source, dry_run=False, max_workers=1):
+    """Rename the files to new names from the name source. The renames are checked first,
+    nothing is renamed in case of any error. If a new name is a name of another renamed file,
+    files are renamed through temporary names.
+
+    Args:
+    files: Paths to the files.
+    source: Name source, see names_from_*().
+    dry_run: If True, nothing is renamed.
+    max_workers: Number of worker threads.
+
+    Returns:
+    List of error messages, empty on success.
+    """
+    errors = check_renames(files, source)
+    if errors:
+        return errors
+
+    renames = [(src, dst) for src, dst in iter_renames(files, source) if src != dst]
+    for src, dst in renames:
         print('Renaming %s to %s' % (src, dst))
-        os.rename(src, dst)
-else:
-    print('Number of files and new names don\'t match')
-    sys.exit(1)
\ No newline at end of file
+    if dry_run:
+        return []
+
+    # renames colliding with other sources go through temporary names
+    sources = set(files)
+    if any(dst in sources for _, dst in renames):
+        token = uuid.uuid4().hex
+        temps = [(src, f'{src}.{token}.tmp') for src, _ in renames]
+        run_renames(temps, max_workers)
+        renames = [(tmp, dst) for (_, tmp), (_, dst) in zip(temps, renames)]
+    run_renames(renames, max_workers)
+    return []
+
+
+def run_renames(renames, max_workers=1):
+    """Perform the renames, on a thread pool if more workers are requested."""
+    if max_workers == 1:
+        for src, dst in renames:
+            os.rename(src, dst)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda x: os.rename(*x), renames))
+
+
+def main():
+    dry_run = False
+    max_workers = 1
+    template = None
+    regex = None
+
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], 'hnj:t:r:')
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(__doc__)
+            sys.exit()
+        elif opt == '-n':
+            dry_run = True
+        elif opt == '-j':
+            max_workers = int(arg)
+        elif opt == '-t':
+            template = arg
+        elif opt == '-r':
+            regex = arg
+
+    # process input arguments
+    if template is not None and len(args) == 1:
+        source = names_from_template(template)
+    elif regex is not None and len(args) == 2:
+        source = names_from_regex(regex, args.pop(0))
+    elif template is None and regex is None and len(args) == 2:
+        source = names_from_file(args.pop())
+    else:
+        print(__doc__)
+        sys.exit(2)
+
+    files = list_files(args[0])
+    errors = rename_files(files, source, dry_run, max_workers)
+    for error in errors:
+        print(f'ERROR: {error}')
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
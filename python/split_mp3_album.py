@@ -2,40 +2,73 @@
 Splits a MP3 album to single songs.
 
 Usage:
-split_mp3_album.py album.mp3 tracklist.txt
+split_mp3_album.py [--gain] album.mp3 tracklist.txt
+split_mp3_album.py [--gain] queue [root_dir] [max_jobs]
+split_mp3_album.py refine [album.mp3]
 
   album.mp3      Path to .mp3 file with the album.
   tracklist.txt  Path to tracklist with track start times and titles.
+  queue          Split all albums found in folders under root_dir, without any prompts.
+                 File album.xml is created for every album, unless it already exists.
+  root_dir       Root folder to be scanned for albums, defaults to current folder.
+  max_jobs       Maximal number of ffmpeg processes running at once, defaults to CPU count.
+                 With --gain every album runs two of them, so half as many albums are split
+                 at once.
+  refine         Snap start times in album.xml to the nearest silence. Only a short window
+                 around every start time is decoded.
+  --gain         Measure loudness of the tracks and the album (EBU R128) while splitting and
+                 write ReplayGain 2.0 values to TXXX frames of the tracks. The album is decoded
+                 just once, the tracks are encoded from the same PCM stream which is measured.
+  --profile[=path]
+                 Print time spent in every stage and track. If a path is given, cProfile
+                 statistics (*.prof) or Chrome trace (*.json) are written to it.
 
 Pre-requisites:
 - ffmpeg binary + its location listed in PATH
 - ffmpeg-python
 - mutagen
+- numpy (for refine and --gain)
 
 Recommended YouTube to MP3 Converter:
 y2mate.com
 """
 
-#TODO Add fault isolation for tracklist parsing. Print the specific track which couldn't be parsed.
-
 import glob
 import os
 import re
 import sys
+import threading
+import time
 import xml.etree.cElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import ffmpeg
-from mutagen.id3 import Encoding, PictureType, ID3, APIC, TALB, TDRC, TIT2, TPE1, TPE2, TRCK
 from mutagen.mp3 import MP3
 
+from id3lib import id3v2, profiling
+from id3lib.profiling import profiler
+
 #---------------------------------------------------------------------------------------------------
 # Constants
 #---------------------------------------------------------------------------------------------------
 
-# debug options
+# debug options; tracks skipped as existing keep their old ID3 tags, they are not re-tagged
 SKIP_EXISTING_TRACKS = False
 STOP_AFTER_X_TRACKS = None
 
+# split point refinement
+REFINE_WINDOW = 5.0         # seconds decoded before and after every start time
+REFINE_SAMPLE_RATE = 8000   # sample rate of decoded PCM, speech quality is enough to find silence
+REFINE_FRAME = 0.02         # length of RMS frame in seconds
+REFINE_THRESHOLD = 0.02     # RMS level (relative to full scale) below which a frame is silent
+
+# size of chunks read from ffmpeg output
+STREAM_CHUNK = 1 << 16
+
+# bytes of padding reserved in the tags for ReplayGain frames, written after the whole album
+# is measured
+GAIN_PADDING = 256
+
 TRACK_FORMATS = [
     ('00:00 Title',            r'([\d:]+)\s+(.+)',              ['start_time', 'title']),
     ('[00:00] Title',          r'\[([\d:]+)\]\s+(.+)',          ['start_time', 'title']),
@@ -50,10 +83,16 @@ TRACK_FORMATS = [
 # Functions
 #---------------------------------------------------------------------------------------------------
 
-def get_input_filenames():
-    if len(sys.argv) == 3:
-        album_mp3_path = sys.argv[1]
-        tracklist_path = sys.argv[2]
+def get_input_filenames(args=None, need_tracklist=True):
+    """Get paths of the album MP3 and the tracklist from the arguments, or find them in
+    the current folder. Tracklist isn't looked for if it isn't needed, its path is None then."""
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) == 2:
+        album_mp3_path = args[0]
+        tracklist_path = args[1]
+    elif len(args) == 1 and not need_tracklist:
+        return (args[0], None)
     else:
         mp3_list = glob.glob('*.mp3')
         if len(mp3_list) > 0:
@@ -61,6 +100,8 @@ def get_input_filenames():
         else:
             print('ERROR: No MP3 file specified, none found.')
             sys.exit(1)
+        if not need_tracklist:
+            return (album_mp3_path, None)
         txt_list = glob.glob('*.txt')
         if len(txt_list) > 0:
             tracklist_path = txt_list[0]
@@ -71,51 +112,107 @@ def get_input_filenames():
     return (album_mp3_path, tracklist_path)
 
 
-def parse_tracklist(path):
+def detect_tracklist_format(lines):
+    """Try all supported tracklist formats against all lines and choose the one which parses
+    the most of them. Ties are resolved in favor of the format with more fields, then by order
+    in TRACK_FORMATS.
+
+    Args:
+    lines: Lines of the tracklist.
+
+    Returns:
+    Tuple (format, tracklist, unparsed) where format is the selected item of TRACK_FORMATS,
+    or None if no format matches any line, tracklist is a list of dicts and unparsed is a list
+    of (line_number, line) tuples which couldn't be parsed with the selected format.
+    """
+
+    regexes = [re.compile(trf[1]) for trf in TRACK_FORMATS]
+    matches = [[] for _ in TRACK_FORMATS]
+    line_count = 0
+
+    # single pass through the lines, every line is tried with every format
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        line_count += 1
+        for i, regex in enumerate(regexes):
+            match = regex.match(line)
+            if match is not None:
+                matches[i].append((line_number, match))
+
+    # select the format with the highest coverage
+    best = max(range(len(TRACK_FORMATS)),
+               key=lambda i: (len(matches[i]), len(TRACK_FORMATS[i][2]), -i))
+    if len(matches[best]) == 0:
+        unparsed = [(n, line.strip()) for n, line in enumerate(lines, start=1) if line.strip()]
+        return (None, [], unparsed)
+    selected_trf = TRACK_FORMATS[best]
+
+    # build the tracklist and report lines which couldn't be parsed
+    trf_fields = selected_trf[2]
+    tracklist = []
+    parsed_lines = set()
+    for line_number, match in matches[best]:
+        track_info = {}
+        for i in range(len(trf_fields)):
+            track_info[trf_fields[i]] = match.group(i + 1).strip()
+        tracklist.append(track_info)
+        parsed_lines.add(line_number)
+    unparsed = [(n, line.strip()) for n, line in enumerate(lines, start=1)
+                if line.strip() and n not in parsed_lines]
+
+    return (selected_trf, tracklist, unparsed)
+
+
+def parse_tracklist(path, interactive=True):
+    """Parse a tracklist text file, its format is detected automatically.
+
+    Args:
+    path: Path to the tracklist text file.
+    interactive: If True, ask for confirmation of the parsed tracklist.
+
+    Returns:
+    Tracklist as a list of dicts, empty if no supported format matches the tracklist (in
+    interactive mode the script exits then).
+    """
 
     # read lines from tracklist text file
     with open(path, "rt", encoding="utf8") as fobj:
         lines = fobj.readlines()
+    profiler.count('bytes_read', os.path.getsize(path))
 
-    # ask for selection of tracklist format
-    print(f'\nFirst line of provided tracklist:')
-    print(lines[0])
-    print('Supported tracklist formats:')
-    trfl_len = len(TRACK_FORMATS)
-    for i in range(trfl_len):
-        trf = TRACK_FORMATS[i]
-        print(f'{i + 1}:   {trf[0]}')
-    ans = int(input(f'\nSelect format (1-{trfl_len}): '))
-    selected_trf = TRACK_FORMATS[int(ans) - 1]
-
-    # parse the line with a regex, to get track info
-    trf_regex = selected_trf[1]
-    trf_fields = selected_trf[2]
-    regex = re.compile(trf_regex)
-    tracklist = []
-    for line in lines:
-        match = regex.match(line)
-        if match is not None:
-            track_info = {}
-            for i in range(len(trf_fields)):
-                track_info[trf_fields[i]] = match.group(i + 1)
-            tracklist.append(track_info)
+    with profiler.stage('tracklist_parse'):
+        (selected_trf, tracklist, unparsed) = detect_tracklist_format(lines)
+
+    if selected_trf is None:
+        print(f'\nERROR: No line of tracklist \'{path}\' matches any supported format:')
+        print('\n'.join(f'  {x[0]}' for x in TRACK_FORMATS))
+        if interactive:
+            sys.exit(1)
+        return tracklist
+
+    print(f'\nDetected tracklist format: {selected_trf[0]}')
+    for line_number, line in unparsed:
+        print(f'WARNING: Line {line_number} couldn\'t be parsed: {line}')
 
     # ask for confirmation of parsed tracklist
-    print(f'\nTracklist has been parsed to following {len(tracklist)} items:')
-    print('\n'.join([str(x) for x in tracklist]))
-    ans = input('\nPlease confirm [Y/n]:')
-    if ans.lower() == 'n':
-        sys.exit(0)
+    if interactive:
+        print(f'\nTracklist has been parsed to following {len(tracklist)} items:')
+        print('\n'.join([str(x) for x in tracklist]))
+        ans = input('\nPlease confirm [Y/n]:')
+        if ans.lower() == 'n':
+            sys.exit(0)
     
     return tracklist
 
 
-def create_album_xml(tracklist):
+def create_album_xml(tracklist, album_dir='.'):
     """Create file 'album.xml' with list of tracks and their parsed information.
     
     Args:
     tracklist: Tracklist as a list of dicts.
+    album_dir: Directory of the album, where the file is created.
     """
 
     album_attrib = {
@@ -146,7 +243,7 @@ def create_album_xml(tracklist):
         album_attrib['artist'] = 'VA'
 
     # detect a cover
-    files = os.listdir('.')
+    files = sorted(os.listdir(album_dir))
     files = [f for f in files if f.endswith('.jpg')]
     if len(files) > 0:
         album_attrib['cover'] = files[0]
@@ -169,40 +266,70 @@ def create_album_xml(tracklist):
     ET.indent(tree)
 
     # write the XML tree to a file
-    tree.write('album.xml', encoding='utf-8', xml_declaration=True)
-    print('\nTracklist has been converted to file album.xml.')
-    print('Please review the file and run the script again to split the MP3.')
+    with profiler.stage('xml_write'):
+        tree.write(os.path.join(album_dir, 'album.xml'), encoding='utf-8', xml_declaration=True)
 
 
-def split_mp3(mp3_path):
+def split_mp3(mp3_path, album_dir='.', quiet=False, gain=False):
     """Split MP3 file to single tracks according to information stored in
     file 'album.xml'.
 
     Args:
     mp3_path: Path to the MP3 file.
+    album_dir: Directory of the album, with file 'album.xml', where the tracks are created.
+    quiet: If True, output of ffmpeg is suppressed (except for errors).
+    gain: If True, loudness is measured and ReplayGain frames are written, see split_pcm().
+
+    Returns:
+    Dict with summary report of the split.
     """
 
+    report = {
+        'album': album_dir,
+        'tracks': 0,
+        'written': 0,
+        'skipped': 0,
+        'failed': [],
+    }
+    time_start = time.perf_counter()
+
     # load album MP3
     album_stream = ffmpeg.input(mp3_path).audio
 
     # load album XML
-    tree = ET.parse('album.xml')
+    with profiler.stage('xml_read'):
+        tree = ET.parse(os.path.join(album_dir, 'album.xml'))
     album_element = tree.getroot()
     
     # load cover image
-    img = album_element.attrib['cover']
-    if os.path.isfile(img):
-        with open(img, 'rb') as fobj:
-            img = fobj.read()
+    img = os.path.join(album_dir, album_element.attrib['cover'])
+    if album_element.attrib['cover'] and os.path.isfile(img):
+        with profiler.stage('cover_read'):
+            with open(img, 'rb') as fobj:
+                img = fobj.read()
+        profiler.count('bytes_read', len(img))
     else:
         img = None
 
     # get bitrate
-    audio = MP3(mp3_path)
+    with profiler.stage('bitrate_probe'):
+        audio = MP3(mp3_path)
     bitrate = int(audio.info.bitrate / 1000)    
 
+    # serialize album-wide ID3 frames once, they are shared by all tracks
+    with profiler.stage('album_frames'):
+        album_frames = b''.join([
+            id3v2.text_frame('TPE2', album_element.attrib['artist']),
+            id3v2.text_frame('TALB', album_element.attrib['name']),
+            id3v2.text_frame('TDRC', album_element.attrib['year']),
+        ])
+        if img is not None:
+            album_frames += id3v2.apic_frame(img)
+
     # iterate through tracklist
     track_count = len(album_element)
+    report['tracks'] = track_count
+    jobs = []
     for i, track_element in enumerate(album_element):
 
         # get data fields from track info
@@ -224,44 +351,491 @@ def split_mp3(mp3_path):
 
         # write output stream
         track_filename = f'{tnum:02d} {fnart}{ttit}.mp3'
-        track_path = track_filename
+        track_path = os.path.join(album_dir, track_filename)
         if not (os.path.exists(track_path) and SKIP_EXISTING_TRACKS):
-            if not tend is None:
-                track_stream = ffmpeg.output(album_stream, track_path, audio_bitrate=f'{bitrate}k',
-                    ss=tsta, to=tend)
+
+            # build ID3 tag in memory
+            with profiler.stage('tag_build', track_path):
+                tag = id3v2.tag(
+                    id3v2.text_frame('TRCK', f'{tnum:02d}'),
+                    id3v2.text_frame('TIT2', ttit),
+                    id3v2.text_frame('TPE1', tart),
+                    album_frames,
+                    padding=GAIN_PADDING if gain else 0,
+                )
+
+            # write the tag followed by the audio frames streamed from ffmpeg
+            if gain:
+                jobs.append((track_filename, track_path, tag, tsta, tend))
             else:
-                track_stream = ffmpeg.output(album_stream, track_path, audio_bitrate=f'{bitrate}k',
-                    ss=tsta)
-            ffmpeg.run(track_stream)
-
-        # write ID3 tags
-        id3 = ID3(track_path)
-        id3.delete()
-        id3.add(TRCK(encoding=Encoding.UTF8, text=f'{tnum:02d}'))
-        id3.add(TIT2(encoding=Encoding.UTF8, text=ttit))
-        id3.add(TPE1(encoding=Encoding.UTF8, text=tart))
-        id3.add(TPE2(encoding=Encoding.UTF8, text=album_element.attrib['artist']))
-        id3.add(TALB(encoding=Encoding.UTF8, text=album_element.attrib['name']))
-        id3.add(TDRC(encoding=Encoding.UTF8, text=album_element.attrib['year']))
-        if img is not None:
-            id3.add(APIC(mime='image/jpeg', type=PictureType.COVER_FRONT, data=img))
-        id3.save()
+                try:
+                    with profiler.stage('ffmpeg_encode', track_path):
+                        write_track(album_stream, track_path, tag, bitrate, tsta, tend, quiet)
+                except ffmpeg.Error:
+                    report['failed'].append(track_filename)
+                    continue
+                report['written'] += 1
+        else:
+            report['skipped'] += 1
 
         # stop after X tracks (to save time while debugging)
         if (STOP_AFTER_X_TRACKS is not None) and (i == (STOP_AFTER_X_TRACKS - 1)):
             break
 
+    # all tracks at once from a single decoded PCM stream
+    if gain:
+        results = split_pcm(mp3_path, [x[1:] for x in jobs], audio.info.sample_rate,
+                            audio.info.channels, bitrate, quiet)
+        meters = []
+        for (track_filename, track_path, tag, _, _), meter in zip(jobs, results):
+            if meter is None:
+                report['failed'].append(track_filename)
+            else:
+                report['written'] += 1
+                meters.append((track_path, tag, meter))
+        report['album_gain'] = write_gain_frames(meters)
+
+    report['elapsed'] = time.perf_counter() - time_start
+    return report
+
+
+def write_track(album_stream, track_path, tag, bitrate, tsta, tend=None, quiet=False):
+    """Encode a track with ffmpeg and write it to a file, prepended with a pre-built ID3 tag.
+    The file is written in a single pass, the audio is streamed from ffmpeg's stdout. If ffmpeg
+    fails, the partially written file is removed.
+
+    As the output is not seekable, ffmpeg can't fill in the Xing/LAME Info header after encoding,
+    so the tracks have no gapless playback data (encoder delay and padding) and players estimate
+    the duration from the bitrate.
+
+    Args:
+    album_stream: ffmpeg audio stream of the album.
+    track_path: Path to the output MP3 file.
+    tag: Serialized ID3v2 tag.
+    bitrate: Audio bitrate in kbps.
+    tsta: Start time of the track.
+    tend: End time of the track, None for the last track.
+    quiet: If True, output of ffmpeg is suppressed (except for errors).
+    """
+
+    kwargs = {'ss': tsta}
+    if tend is not None:
+        kwargs['to'] = tend
+
+    # ffmpeg must not write its own ID3 tag, ours is prepended instead
+    track_stream = ffmpeg.output(album_stream, 'pipe:', format='mp3', audio_bitrate=f'{bitrate}k',
+                                 id3v2_version=0, write_id3v1=0, map_metadata=-1, **kwargs)
+    track_stream = track_stream.global_args('-nostdin')
+    if quiet:
+        track_stream = track_stream.global_args('-loglevel', 'error')
+    process = track_stream.run_async(pipe_stdout=True)
+    copy_to_file(process.stdout, track_path, tag)
+
+    retcode = process.wait()
+    if retcode:
+        os.remove(track_path)
+        raise ffmpeg.Error('ffmpeg', None, None)
+
+
+def copy_to_file(stream, track_path, tag):
+    """Write the ID3 tag followed by everything read from the stream to a file."""
+    with open(track_path, 'wb') as fobj:
+        fobj.write(tag)
+        for chunk in iter(lambda: stream.read(STREAM_CHUNK), b''):
+            fobj.write(chunk)
+        profiler.count('bytes_written', fobj.tell())
+    profiler.count('files_written')
+
+
+def start_encoder(track_path, tag, sample_rate, channels, bitrate, quiet=False):
+    """Start ffmpeg encoding raw PCM (32-bit float) from its stdin to a track file, prepended
+    with a pre-built ID3 tag. The encoded audio is copied to the file by a separate thread. Like
+    in write_track(), the track has no Xing/LAME Info header.
+
+    Returns:
+    Tuple (process, thread).
+    """
+    track_stream = (
+        ffmpeg
+        .input('pipe:', format='f32le', ac=channels, ar=sample_rate)
+        .output('pipe:', format='mp3', audio_bitrate=f'{bitrate}k', id3v2_version=0,
+                write_id3v1=0, map_metadata=-1)
+    )
+    if quiet:
+        track_stream = track_stream.global_args('-loglevel', 'error')
+    process = track_stream.run_async(pipe_stdin=True, pipe_stdout=True)
+    thread = threading.Thread(target=copy_to_file, args=(process.stdout, track_path, tag))
+    thread.start()
+    return (process, thread)
+
+
+def split_pcm(mp3_path, tracks, sample_rate, channels, bitrate, quiet=False):
+    """Decode the album once and split the PCM stream to tracks. Every track is encoded by its
+    own ffmpeg process fed from the stream, while its loudness is measured from the same samples.
+
+    Args:
+    mp3_path: Path to the MP3 file.
+    tracks: List of tuples (track_path, tag, tsta, tend) sorted by start time, tend is None
+        for the last track.
+    sample_rate, channels: Format of the album audio, it is kept in the tracks.
+    bitrate: Audio bitrate in kbps.
+    quiet: If True, output of ffmpeg is suppressed (except for errors).
+
+    Returns:
+    List with LoudnessMeter of every track, None for tracks which failed.
+    """
+    # imported here, numpy is needed only by refine and --gain
+    import numpy as np
+    from id3lib import loudness
+
+    decoder = ffmpeg.input(mp3_path).audio.output('pipe:', format='f32le', acodec='pcm_f32le')
+    decoder = decoder.global_args('-nostdin')
+    if quiet:
+        decoder = decoder.global_args('-loglevel', 'error')
+    decoder = decoder.run_async(pipe_stdout=True)
+
+    # track boundaries in samples
+    bounds = [(round(parse_time(tsta) * sample_rate),
+               round(parse_time(tend) * sample_rate) if tend is not None else None)
+              for _, _, tsta, tend in tracks]
+    results = [None] * len(tracks)
+    frame_size = 4 * channels
+    position = 0
+    current = 0
+    encoder = None
+    leftover = b''
+    decoded = False
+
+    def finish_track():
+        (process, thread, meter) = encoder
+        process.stdin.close()
+        thread.join()
+        if process.wait() == 0:
+            results[current] = meter
+        else:
+            os.remove(tracks[current][0])
+
+    def abort_track():
+        (process, thread, _) = encoder
+        process.kill()
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        thread.join()
+        process.wait()
+        try:
+            os.remove(tracks[current][0])
+        except OSError:
+            pass
+
+    try:
+        for chunk in iter(lambda: decoder.stdout.read(STREAM_CHUNK), b''):
+            profiler.count('pcm_bytes_decoded', len(chunk))
+            data = leftover + chunk
+            count = len(data) // frame_size
+            leftover = data[count * frame_size:]
+            samples = np.frombuffer(data, dtype=np.float32, count=count * channels)
+            samples = samples.reshape(count, channels)
+
+            # distribute the samples to the tracks
+            offset = 0
+            while offset < count and current < len(tracks):
+                (start, end) = bounds[current]
+                if position + offset < start:
+                    offset = min(count, start - position)
+                    continue
+                if encoder is None:
+                    (track_path, tag, _, _) = tracks[current]
+                    encoder = start_encoder(track_path, tag, sample_rate, channels, bitrate, quiet)
+                    encoder += (loudness.LoudnessMeter(sample_rate, channels),)
+                stop = count if end is None else max(offset, min(count, end - position))
+                block = samples[offset:stop]
+                try:
+                    encoder[0].stdin.write(block.tobytes())
+                except BrokenPipeError:
+                    pass    # encoder failed, reported by its exit code
+                with profiler.stage('loudness', tracks[current][0]):
+                    encoder[2].add(block)
+                offset = stop
+                if end is not None and position + offset >= end:
+                    finish_track()
+                    encoder = None
+                    current += 1
+            position += count
+
+        if encoder is not None:
+            finish_track()
+            encoder = None
+        decoded = True
+    finally:
+        # on errors the unfinished track and the decoder are killed, so no ffmpeg process or
+        # copying thread is left behind
+        if encoder is not None:
+            abort_track()
+        if not decoded:
+            decoder.kill()
+        decoder.stdout.close()
+        retcode = decoder.wait()
+
+    if retcode:
+        raise ffmpeg.Error('ffmpeg', None, None)
+    return results
+
+
+def write_gain_frames(meters):
+    """Write ReplayGain TXXX frames to the padding reserved in the tags of the tracks. If the
+    frames don't fit to the padding (eg. very long values), the tag is rewritten instead.
+
+    Args:
+    meters: List of tuples (track_path, tag, meter) of all tracks of the album.
+
+    Returns:
+    Album gain as text, eg. '-6.52 dB', or None if the album is silent.
+    """
+    from id3lib import loudness
+
+    with profiler.stage('album_loudness'):
+        album_loudness = loudness.album_loudness([x[2] for x in meters])
+    if album_loudness is None:
+        return None
+    album_peak = max(x[2].peak for x in meters)
+    album_tags = loudness.replaygain_tags(album_loudness, album_peak, 'ALBUM')
+
+    for track_path, tag, meter in meters:
+        track_loudness = meter.loudness()
+        tags = loudness.replaygain_tags(track_loudness, meter.peak) \
+            if track_loudness is not None else {}
+        tags.update(album_tags)
+        frames = b''.join(id3v2.txxx_frame(k, v) for k, v in tags.items())
+        if len(frames) > GAIN_PADDING:
+            id3v2.replace_frames(track_path, 'TXXX', frames)
+            continue
+        with open(track_path, 'r+b') as fobj:
+            fobj.seek(len(tag) - GAIN_PADDING)
+            fobj.write(frames)
+
+    return album_tags['REPLAYGAIN_ALBUM_GAIN']
+
+
+def parse_time(text):
+    """Convert time in format [HH:]MM:SS[.mmm] to seconds."""
+    seconds = 0.0
+    for part in text.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def format_time(seconds):
+    """Convert seconds to time in format [HH:]MM:SS.mmm."""
+    # rounded first, so eg. 119.9996 is '02:00.000', not '01:60.000'
+    (minutes, seconds) = divmod(round(seconds * 1000) / 1000, 60)
+    (hours, minutes) = divmod(int(minutes), 60)
+    if hours > 0:
+        return f'{hours}:{minutes:02d}:{seconds:06.3f}'
+    return f'{minutes:02d}:{seconds:06.3f}'
+
+
+def decode_window(mp3_path, start, duration):
+    """Decode a window of the MP3 file to mono PCM.
+
+    Returns:
+    NumPy array of float samples in range <-1, 1>.
+    """
+    import numpy as np
+    with profiler.stage('decode_window'):
+        (out, _) = (
+            ffmpeg
+            .input(mp3_path, ss=start, t=duration)
+            .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=REFINE_SAMPLE_RATE)
+            .run(capture_stdout=True, quiet=True)
+        )
+    profiler.count('pcm_bytes_decoded', len(out))
+    return np.frombuffer(out, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def find_nearest_silence(samples, center):
+    """Find the silent frame nearest to the center of the window.
+
+    Args:
+    samples: PCM samples of the window.
+    center: Position of the original split point in the window, in seconds.
+
+    Returns:
+    Position of the middle of the nearest silent frame in seconds, or None if there is no silence
+    in the window.
+    """
+    import numpy as np
+    frame_len = int(REFINE_FRAME * REFINE_SAMPLE_RATE)
+    frame_count = len(samples) // frame_len
+    if frame_count == 0:
+        return None
+
+    # RMS of all frames at once
+    frames = samples[:frame_count * frame_len].reshape(frame_count, frame_len)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+
+    silent = np.flatnonzero(rms < REFINE_THRESHOLD)
+    if len(silent) == 0:
+        return None
+
+    positions = (silent + 0.5) * REFINE_FRAME
+    return float(positions[np.argmin(np.abs(positions - center))])
+
+
+def refine_split_points(mp3_path, album_dir='.'):
+    """Snap start times of the tracks in file 'album.xml' to the nearest silence. Only a short
+    window around every start time is decoded. Original start time is kept in attribute
+    'original_start_time', so the refinement can be repeated.
+
+    Args:
+    mp3_path: Path to the MP3 file.
+    album_dir: Directory of the album, with file 'album.xml'.
+    """
+
+    xml_path = os.path.join(album_dir, 'album.xml')
+    tree = ET.parse(xml_path)
+    album_element = tree.getroot()
+
+    for i, track_element in enumerate(album_element):
+        original = track_element.attrib.get('original_start_time',
+                                            track_element.attrib['start_time'])
+        tsta = parse_time(original)
+        if tsta == 0:
+            continue
+
+        window_start = max(tsta - REFINE_WINDOW, 0.0)
+        samples = decode_window(mp3_path, window_start, 2 * REFINE_WINDOW)
+        with profiler.stage('silence_search'):
+            silence = find_nearest_silence(samples, tsta - window_start)
+        if silence is None:
+            print(f'{i + 1:02d}: no silence found near {original}')
+            continue
+
+        refined = format_time(window_start + silence)
+        track_element.set('original_start_time', original)
+        track_element.set('start_time', refined)
+        print(f'{i + 1:02d}: {original} -> {refined}')
+
+    ET.indent(tree)
+    tree.write(xml_path, encoding='utf-8', xml_declaration=True)
+
+
+def find_album_dirs(root_dir):
+    """Find album folders, ie. folders with a MP3 file and a tracklist, under the root folder.
+
+    Args:
+    root_dir: Root folder to be scanned.
+
+    Returns:
+    List of tuples (album_dir, album_mp3_path, tracklist_path). The album MP3 is the largest MP3
+    file in the folder, so that the already split tracks are not picked up.
+    """
+
+    albums = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames.sort()
+        mp3_list = [f for f in filenames if f.lower().endswith('.mp3')]
+        txt_list = sorted([f for f in filenames if f.lower().endswith('.txt')])
+        if len(mp3_list) > 0 and len(txt_list) > 0:
+            mp3_list = [os.path.join(dirpath, f) for f in mp3_list]
+            album_mp3_path = max(mp3_list, key=os.path.getsize)
+            albums.append((dirpath, album_mp3_path, os.path.join(dirpath, txt_list[0])))
+
+    return albums
+
+
+def process_album(album_dir, album_mp3_path, tracklist_path, gain=False):
+    """Build (or reuse) file 'album.xml' of an album without any prompts and split the album.
+
+    Returns:
+    Dict with summary report of the split.
+    """
+
+    # errors of a single album (eg. tracklist not in UTF-8) must not stop the queue
+    try:
+        if not os.path.isfile(os.path.join(album_dir, 'album.xml')):
+            tracklist = parse_tracklist(tracklist_path, interactive=False)
+            if len(tracklist) == 0:
+                return {'album': album_dir, 'error': 'tracklist couldn\'t be parsed'}
+            create_album_xml(tracklist, album_dir)
+
+        return split_mp3(album_mp3_path, album_dir, quiet=True, gain=gain)
+    except Exception as ex:
+        return {'album': album_dir, 'error': str(ex)}
+
+
+def process_queue(root_dir='.', max_jobs=None, gain=False):
+    """Split all albums found under the root folder. Albums are processed concurrently, each
+    album runs one ffmpeg process at a time (two with gain, a decoder and an encoder), so there
+    are at most 'max_jobs' (or 'max_jobs' / 2 with gain) albums split at once.
+
+    Args:
+    root_dir: Root folder to be scanned for albums.
+    max_jobs: Maximal number of ffmpeg processes running at once, defaults to CPU count.
+    gain: If True, ReplayGain frames are written, see split_pcm().
+    """
+
+    albums = find_album_dirs(root_dir)
+    print(f'Found {len(albums)} album(s) in \'{root_dir}\'.')
+    if max_jobs is None:
+        max_jobs = os.cpu_count() or 1
+    max_albums = max(1, max_jobs // 2) if gain else max_jobs
+
+    with ThreadPoolExecutor(max_workers=max_albums) as executor:
+        futures = [executor.submit(process_album, *album, gain) for album in albums]
+        for future in as_completed(futures):
+            report = future.result()
+            if 'error' in report:
+                print(f'{report["album"]}: ERROR: {report["error"]}')
+            else:
+                print(f'{report["album"]}: {report["written"]}/{report["tracks"]} tracks written,'
+                      f' {report["skipped"]} skipped, {len(report["failed"])} failed'
+                      f' ({report["elapsed"]:.1f} s)')
+                if report.get('album_gain'):
+                    print(f'  album gain: {report["album_gain"]}')
+                for track_filename in report['failed']:
+                    print(f'  failed: {track_filename}')
+
 #---------------------------------------------------------------------------------------------------
 # Script Body
 #---------------------------------------------------------------------------------------------------
 
 def main():
+    # profiling option can be anywhere in the arguments
+    sys.argv = profiling.parse_argv(sys.argv)
+    gain = '--gain' in sys.argv
+    if gain:
+        sys.argv.remove('--gain')
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'queue':
+        root_dir = sys.argv[2] if len(sys.argv) > 2 else '.'
+        max_jobs = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        process_queue(root_dir, max_jobs, gain)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'refine':
+        (al_path, _) = get_input_filenames(sys.argv[2:], need_tracklist=False)
+        if not os.path.isfile('album.xml'):
+            print('ERROR: File album.xml not found, run the script without \'refine\' first.')
+            sys.exit(1)
+        refine_split_points(al_path)
+        print('\nStart times in file album.xml have been snapped to the nearest silence.')
+        return
+
     (al_path, tl_path) = get_input_filenames()
     if not os.path.isfile('album.xml'):
         tracklist = parse_tracklist(tl_path)
         create_album_xml(tracklist)
+        print('\nTracklist has been converted to file album.xml.')
+        print('Please review the file and run the script again to split the MP3.')
     else:
-        split_mp3(al_path)
+        report = split_mp3(al_path, gain=gain)
+        if report.get('album_gain'):
+            print(f'\nAlbum gain: {report["album_gain"]}')
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        profiler.finish()